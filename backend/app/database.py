@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.schema import CreateTable
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./qsnap.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./qsnap.db")
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
@@ -10,6 +14,62 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+@event.listens_for(Engine, "connect")
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores ON DELETE CASCADE unless foreign keys are switched on per connection
+    if type(dbapi_connection).__module__.startswith("sqlite3"):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+def migrate(bind=engine):
+    """
+    Brings databases created by older versions up to the current models.
+    create_all() only creates missing tables, so anything else is patched here.
+    """
+    from . import models
+
+    with bind.connect() as conn:
+        # New nullable columns on existing tables
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                print(f"Migrating {table.name}: adding column {column.name}")
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}')
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        conn.commit()
+
+        # questions.paper_id used to be a plain FK without ON DELETE CASCADE.
+        # SQLite can't alter a constraint, so the table is rebuilt once: a new table is filled and
+        # renamed into place, so FKs from other tables (solutions) keep pointing at "questions".
+        fks = conn.exec_driver_sql("PRAGMA foreign_key_list(questions)").fetchall()
+        if any(fk[2] == "papers" and fk[6] != "CASCADE" for fk in fks):
+            print("Migrating questions table: ON DELETE CASCADE")
+            table = models.Question.__table__
+            conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            old_columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(questions)")]
+            create_sql = str(CreateTable(table).compile(dialect=conn.dialect))
+            conn.exec_driver_sql(create_sql.replace("CREATE TABLE questions ", "CREATE TABLE questions_new ", 1))
+            columns = ", ".join(c for c in old_columns if c in table.c)
+            conn.exec_driver_sql(f"INSERT INTO questions_new ({columns}) SELECT {columns} FROM questions")
+            # Takes the old indexes and triggers with it
+            conn.exec_driver_sql("DROP TABLE questions")
+            conn.exec_driver_sql("ALTER TABLE questions_new RENAME TO questions")
+            for index in table.indexes:
+                index.create(conn)
+            conn.commit()
+            conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+            # Re-runs the metadata DDL hooks, which recreate the triggers on questions
+            Base.metadata.create_all(bind=conn)
+            conn.commit()
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,18 +1,27 @@
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
-from .database import engine, Base
-from .routers import papers, questions
-
-# Load environment variables from .env file
+# Load environment variables from .env file (before .database reads DATABASE_URL)
 load_dotenv()
 
-Base.metadata.create_all(bind=engine)
+from .database import engine, Base, migrate
+from .routers import papers, questions, ingest, images, backfill, search, batches
+from .services import search as search_index
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema setup runs when the server starts, not when the module is imported
+    Base.metadata.create_all(bind=engine)
+    migrate(engine)
+    # The FTS table is created with the others; this indexes rows from before it existed
+    search_index.ensure_index(engine)
+    yield
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Setup CORS for frontend
 app.add_middleware(
@@ -31,6 +40,11 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Include routers
 app.include_router(papers.router)
 app.include_router(questions.router)
+app.include_router(ingest.router)
+app.include_router(images.router)
+app.include_router(backfill.router)
+app.include_router(search.router)
+app.include_router(batches.router)
 
 @app.get("/")
 def read_root():
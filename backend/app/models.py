@@ -11,14 +11,21 @@ class Paper(Base):
     file_path = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     is_processed = Column(Boolean, default=False)
+    batch_id = Column(String, index=True, nullable=True) # Set for papers created by /ingest
+    # Estimated tokens of the OCR text before/after normalization (services/normalize)
+    ocr_tokens_before = Column(Integer, nullable=True)
+    ocr_tokens_after = Column(Integer, nullable=True)
     
-    questions = relationship("Question", back_populates="paper")
+    # Questions go with their paper; the DB cascade does the work, so nothing is loaded to delete them
+    questions = relationship(
+        "Question", back_populates="paper", cascade="all, delete-orphan", passive_deletes=True
+    )
 
 class Question(Base):
     __tablename__ = "questions"
 
     id = Column(Integer, primary_key=True, index=True)
-    paper_id = Column(Integer, ForeignKey("papers.id"))
+    paper_id = Column(Integer, ForeignKey("papers.id", ondelete="CASCADE"))
     
     image_path = Column(String) # Path to the cropped image
     bbox_json = Column(String) # JSON string of [x, y, w, h]
@@ -32,3 +39,71 @@ class Question(Base):
     order_index = Column(Integer, default=0)
     
     paper = relationship("Paper", back_populates="questions")
+    solutions = relationship(
+        "Solution", back_populates="question", cascade="all, delete-orphan", passive_deletes=True,
+        order_by="Solution.id"
+    )
+
+class Solution(Base):
+    """
+    Every answer ever produced for a question, with what produced it.
+    Question.answer/analysis mirror the row flagged is_current.
+    """
+    __tablename__ = "solutions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), index=True)
+
+    model = Column(String)
+    prompt_version = Column(String)
+    input_hash = Column(String, index=True) # Content hash of the question text that was solved
+
+    answer = Column(Text, default="")
+    analysis = Column(Text, default="")
+    is_current = Column(Boolean, default=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    question = relationship("Question", back_populates="solutions")
+
+class BackfillRun(Base):
+    """
+    Checkpoint of a background re-solve run, so it can resume where it stopped.
+    """
+    __tablename__ = "backfill_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    prompt_version = Column(String)
+    status = Column(String, default="running") # running | stopped | budget_exhausted | completed
+    last_question_id = Column(Integer, default=0)
+    solved = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    tokens_used = Column(Integer, default=0)
+    token_budget = Column(Integer, default=0)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BatchJob(Base):
+    """
+    A solve/format job sent to the provider's offline batch API (services/batch.py).
+    """
+    __tablename__ = "batch_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String) # solve | format
+    provider_batch_id = Column(String, unique=True, index=True)
+    input_file_id = Column(String)
+    output_file_id = Column(String, nullable=True)
+    error_file_id = Column(String, nullable=True)
+    model = Column(String)
+    prompt_version = Column(String)
+    question_ids = Column(Text, default="[]") # JSON list, used to avoid submitting a question twice
+    # Provider status (validating | in_progress | finalizing | completed | failed | expired | cancelled),
+    # then "applied" once the results have been written back
+    status = Column(String, default="validating", index=True)
+    request_count = Column(Integer, default=0)
+    applied = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,5 +1,6 @@
-from .solver import SOLVER_SYSTEM_PROMPT, SOLVER_USER_PROMPT
+from .solver import SOLVER_SYSTEM_PROMPT, SOLVER_USER_PROMPT, SOLVER_PROMPT_VERSION
 from .splitter import SPLITTER_SYSTEM_PROMPT, SPLITTER_USER_PROMPT
 from .formatter import FORMATTER_SYSTEM_PROMPT, FORMATTER_USER_PROMPT
 
 
+from .repair import REPAIR_USER_PROMPT
@@ -20,8 +20,8 @@ FORMATTER_USER_PROMPT = """Segment:
 {text}
 
 Output JSON format:
-{
+{{
     "formatted_text": "string",
     "is_complete": boolean
-}
+}}
 """
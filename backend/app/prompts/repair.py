@@ -0,0 +1,5 @@
+# Follow-up turn used only when a JSON reply could not be parsed or repaired locally
+REPAIR_USER_PROMPT = """Your previous reply could not be used: {error}
+Reply again with only the corrected JSON and no other text.
+Inside JSON strings, every backslash (including LaTeX such as \\frac) must be escaped as \\\\.
+"""
@@ -1,3 +1,6 @@
+# Bump whenever the solver prompts change; stored with every solution so stale ones can be re-solved
+SOLVER_PROMPT_VERSION = "1"
+
 # System prompt for the academic tutor
 SOLVER_SYSTEM_PROMPT = """
 你是一位专业的学术导师。
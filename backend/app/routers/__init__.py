@@ -1 +1 @@
-from . import papers, questions
\ No newline at end of file
+from . import papers, questions, ingest, images, backfill, search, batches
\ No newline at end of file
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..services import backfill, batch
+
+router = APIRouter()
+
+@router.post("/backfill/start")
+def start_backfill(rate_per_minute: float = None, token_budget: int = None, mode: str = "sync",
+                   db: Session = Depends(get_db)):
+    """
+    Re-solves questions whose solution is stale. Resumes the last unfinished run if there is one.
+    mode=batch sends them to the provider's batch API instead (see /batches).
+    """
+    if mode == "batch":
+        try:
+            job = batch.submit(db, "solve", batch.collect_stale(db))
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Batch submission failed: {e}")
+        if job is None:
+            return {"status": "nothing_to_submit"}
+        batch.poller.start()
+        return {"status": job.status, "batch_id": job.id, "requests": job.request_count}
+
+    backfill.runner.start(rate_per_minute=rate_per_minute, token_budget=token_budget)
+    return backfill.runner.status(db)
+
+@router.post("/backfill/stop")
+def stop_backfill(db: Session = Depends(get_db)):
+    backfill.runner.stop()
+    backfill.runner.join(timeout=5)
+    return backfill.runner.status(db)
+
+@router.get("/backfill/status")
+def get_backfill_status(db: Session = Depends(get_db)):
+    status = backfill.runner.status(db)
+    status["active"] = backfill.runner.is_running()
+    return status
@@ -0,0 +1,71 @@
+import json
+from fastapi import APIRouter, Body, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+
+from ..database import get_db
+from .. import models
+from ..services import batch
+
+router = APIRouter()
+
+def _job_dict(job) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "provider_batch_id": job.provider_batch_id,
+        "status": job.status,
+        "model": job.model,
+        "request_count": job.request_count,
+        "question_ids": json.loads(job.question_ids or "[]"),
+        "applied": job.applied,
+        "skipped": job.skipped,
+        "failed": job.failed,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+@router.post("/batches")
+def submit_batch(kind: str = "solve", limit: int = batch.MAX_REQUESTS,
+                 question_ids: List[int] = Body(None, embed=True), db: Session = Depends(get_db)):
+    """
+    Sends non-urgent solve/format work to the provider's batch API.
+    Without question_ids, a solve batch takes the questions whose solution is stale.
+    """
+    if kind not in batch.KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {sorted(batch.KINDS)}")
+    if question_ids:
+        questions = db.query(models.Question).filter(models.Question.id.in_(question_ids)).all()
+    elif kind == "solve":
+        questions = batch.collect_stale(db, limit)
+    else:
+        raise HTTPException(status_code=400, detail="question_ids is required for format batches")
+
+    try:
+        job = batch.submit(db, kind, questions[:limit])
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Batch submission failed: {e}")
+    if job is None:
+        return {"status": "nothing_to_submit"}
+
+    batch.poller.start()
+    return _job_dict(job)
+
+@router.get("/batches")
+def list_batches(db: Session = Depends(get_db)):
+    jobs = db.query(models.BatchJob).order_by(models.BatchJob.id.desc()).all()
+    return [_job_dict(job) for job in jobs]
+
+@router.get("/batches/{job_id}")
+def get_batch(job_id: int, refresh: bool = False, db: Session = Depends(get_db)):
+    job = db.query(models.BatchJob).filter(models.BatchJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if refresh:
+        # Poll now instead of waiting for the poller (also resumes jobs left open by a restart)
+        try:
+            batch.refresh(db, job)
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Batch refresh failed: {e}")
+        batch.poller.start()
+    return _job_dict(job)
@@ -0,0 +1,105 @@
+import os
+from urllib.parse import urlencode
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import FileResponse, RedirectResponse
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from .. import models
+from ..services import images
+
+router = APIRouter()
+
+# Derivative URLs contain the content hash of the original, so they can be cached forever
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+def _pick_format(fmt: str, request: Request) -> str:
+    if fmt in images.FORMATS:
+        return fmt
+    return "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+
+def _source(kind: str, obj_id: int, db: Session):
+    """
+    (source file, default bbox) for a paper or question image.
+    """
+    if kind == "papers":
+        paper = db.query(models.Paper).filter(models.Paper.id == obj_id).first()
+        if not paper:
+            raise HTTPException(status_code=404, detail="Paper not found")
+        return paper.file_path, []
+
+    if kind == "questions":
+        q = db.query(models.Question).filter(models.Question.id == obj_id).first()
+        if not q:
+            raise HTTPException(status_code=404, detail="Question not found")
+        paper_path = q.paper.file_path if q.paper else None
+        if q.image_path and q.image_path != paper_path:
+            # Legacy rows point at a crop that was written at processing time
+            return q.image_path, []
+        return paper_path, images.parse_bbox(q.bbox_json)
+
+    raise HTTPException(status_code=404, detail="Unknown image kind")
+
+def _redirect(kind: str, obj_id: int, w: int, fmt: str, request: Request, db: Session):
+    source_path, bbox = _source(kind, obj_id, db)
+    if not source_path or not os.path.exists(source_path):
+        raise HTTPException(status_code=404, detail="Image file missing")
+
+    fmt = _pick_format(fmt, request)
+    width = images.bucket_width(w)
+    key = images.derivative_key(images.file_digest(source_path), bbox, width, fmt)
+
+    params = {}
+    if width:
+        params["w"] = width
+    if bbox:
+        params["bbox"] = ",".join(map(str, bbox))
+    url = f"/images/{kind}/{obj_id}/{key}.{fmt}"
+    if params:
+        url += f"?{urlencode(params)}"
+    # The redirect itself must not be cached for long: it changes when the original does
+    return RedirectResponse(url, status_code=307, headers={"Cache-Control": "no-cache", "Vary": "Accept"})
+
+@router.get("/papers/{paper_id}/image")
+def paper_image(paper_id: int, request: Request, w: int = None, fmt: str = None, db: Session = Depends(get_db)):
+    return _redirect("papers", paper_id, w, fmt, request, db)
+
+@router.get("/questions/{question_id}/image")
+def question_image(question_id: int, request: Request, w: int = None, fmt: str = None, db: Session = Depends(get_db)):
+    return _redirect("questions", question_id, w, fmt, request, db)
+
+@router.get("/images/{kind}/{obj_id}/{filename}")
+def get_image(kind: str, obj_id: int, filename: str, request: Request,
+              w: int = None, bbox: str = None, db: Session = Depends(get_db)):
+    key, _, fmt = filename.partition(".")
+    if fmt not in images.FORMATS:
+        raise HTTPException(status_code=404, detail="Unknown image format")
+
+    source_path, _ = _source(kind, obj_id, db)
+    if not source_path or not os.path.exists(source_path):
+        raise HTTPException(status_code=404, detail="Image file missing")
+
+    try:
+        crop = images.parse_bbox(bbox)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid bbox")
+    width = images.bucket_width(w)
+
+    # A key that doesn't match the current original is stale (or made up): never serve it
+    if images.derivative_key(images.file_digest(source_path), crop, width, fmt) != key:
+        raise HTTPException(status_code=404, detail="Image version not found")
+
+    # Only a key that was just validated may be answered from the client's copy
+    if request.headers.get("if-none-match") == f'"{key}"':
+        return Response(status_code=304, headers={"Cache-Control": IMMUTABLE_CACHE, "ETag": f'"{key}"'})
+
+    try:
+        path = images.render(source_path, crop, width, fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    return FileResponse(
+        path,
+        media_type=images.FORMATS[fmt][0],
+        headers={"Cache-Control": IMMUTABLE_CACHE, "ETag": f'"{key}"'},
+    )
@@ -0,0 +1,77 @@
+import os
+import uuid
+import shutil
+import zipfile
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks, Request
+from sqlalchemy.orm import Session
+from typing import List
+
+from ..database import get_db
+from .. import models
+from ..services import pipeline, scheduler
+
+router = APIRouter()
+
+UPLOAD_DIR = "static/uploads"
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+def _store(stream, filename: str, batch_id: str) -> str:
+    # Batch prefix: a class set is full of IMG_0001.jpg style names that would overwrite each other
+    safe_name = os.path.basename(filename.replace("\\", "/"))
+    file_location = f"{UPLOAD_DIR}/{batch_id[:8]}_{uuid.uuid4().hex[:8]}_{safe_name}"
+    with open(file_location, "wb") as buffer:
+        shutil.copyfileobj(stream, buffer)
+    return file_location
+
+def _is_image(filename: str) -> bool:
+    name = os.path.basename(filename)
+    return not name.startswith(".") and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+@router.post("/ingest")
+def ingest_papers(request: Request, background_tasks: BackgroundTasks,
+                  files: List[UploadFile] = File(...), db: Session = Depends(get_db)):
+    """
+    Bulk upload: any mix of images and ZIP archives of images.
+    All papers are created in one transaction and processed through the OCR -> split -> solve pipeline.
+    """
+    batch_id = uuid.uuid4().hex
+    stored = []  # (filename, file_path)
+
+    for upload in files:
+        if zipfile.is_zipfile(upload.file):
+            upload.file.seek(0)
+            with zipfile.ZipFile(upload.file) as archive:
+                for member in sorted(archive.infolist(), key=lambda m: m.filename):
+                    if member.is_dir() or "__MACOSX" in member.filename or not _is_image(member.filename):
+                        continue
+                    with archive.open(member) as stream:
+                        stored.append((os.path.basename(member.filename), _store(stream, member.filename, batch_id)))
+        else:
+            upload.file.seek(0)
+            if not _is_image(upload.filename or ""):
+                continue
+            stored.append((upload.filename, _store(upload.file, upload.filename, batch_id)))
+
+    if not stored:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+
+    papers = [models.Paper(filename=name, file_path=path, batch_id=batch_id) for name, path in stored]
+    db.add_all(papers)
+    db.commit()
+    paper_ids = [paper.id for paper in papers]
+    print(f"Ingested batch {batch_id}: {len(paper_ids)} papers")
+
+    background_tasks.add_task(
+        pipeline.run_batch, batch_id, paper_ids, scheduler.user_from_request(request)
+    )
+
+    return {"batch_id": batch_id, "paper_ids": paper_ids, "papers": len(paper_ids)}
+
+@router.get("/ingest/{batch_id}")
+def get_ingest_progress(batch_id: str, db: Session = Depends(get_db)):
+    progress = pipeline.batch_progress(db, batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return progress
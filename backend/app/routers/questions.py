@@ -1,14 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
 from ..database import get_db
 from .. import models
-from ..services import llm
+from ..services import pipeline, scheduler, singleflight, solutions
 
 router = APIRouter()
 
 @router.post("/solve/{question_id}")
-def solve_question(question_id: int, db: Session = Depends(get_db)):
+def solve_question(question_id: int, request: Request, db: Session = Depends(get_db)):
+    # Repeated clicks / several tabs on the same question share one solve
+    user = scheduler.user_from_request(request)
+    return singleflight.do(("solve_question", question_id), _solve_question, question_id, user, db)
+
+def _solve_question(question_id: int, user: str, db: Session):
     q = db.query(models.Question).filter(models.Question.id == question_id).first()
     if not q:
         raise HTTPException(status_code=404, detail="Question not found")
@@ -17,12 +22,41 @@ def solve_question(question_id: int, db: Session = Depends(get_db)):
     start_text = q.ocr_text if q.ocr_text else "Identify this question from image."
     # If we wanted to send image to LLM, we'd do it here. For now, text only.
     
-    sol_result = llm.solve_question(start_text)
+    # Interactive: jumps ahead of queued background solves in the shared LLM lane.
+    # Once it has a worker it joins a background solve of the same text if one is in flight.
+    sol_result = scheduler.llm.run(
+        pipeline.solve_text, start_text,
+        priority=scheduler.INTERACTIVE, user=user
+    )
     
-    q.answer = sol_result.get("answer", "")
-    q.analysis = sol_result.get("analysis", "")
-    q.solution_text = q.analysis # Keep populated
+    if solutions.record_solution(db, q, sol_result) is None:
+        # Keep the previous answer; report the failure instead of storing it as a solution
+        raise HTTPException(status_code=502, detail=sol_result.get("analysis") or "Solving failed")
     
     db.commit()
     
     return {"solution": q.analysis, "answer": q.answer}
+
+@router.get("/questions/{question_id}/solutions")
+def list_solutions(question_id: int, db: Session = Depends(get_db)):
+    """
+    Every recorded solution version for a question, newest first.
+    """
+    q = db.query(models.Question).filter(models.Question.id == question_id).first()
+    if not q:
+        raise HTTPException(status_code=404, detail="Question not found")
+    rows = db.query(models.Solution).filter(
+        models.Solution.question_id == question_id
+    ).order_by(models.Solution.id.desc()).all()
+    return [
+        {
+            "id": s.id,
+            "model": s.model,
+            "prompt_version": s.prompt_version,
+            "answer": s.answer,
+            "analysis": s.analysis,
+            "is_current": s.is_current,
+            "created_at": s.created_at,
+        }
+        for s in rows
+    ]
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..services import search
+
+router = APIRouter()
+
+@router.get("/search")
+def search_questions(q: str = Query(..., min_length=1), page: int = Query(1, ge=1),
+                     page_size: int = Query(20, ge=1, le=100), paper_id: int = None,
+                     db: Session = Depends(get_db)):
+    """
+    Full-text search over question text, answers and analyses, best matches first.
+    Snippets are HTML-escaped with hits wrapped in <mark>.
+    """
+    total, hits = search.search(db, q, limit=page_size, offset=(page - 1) * page_size, paper_id=paper_id)
+    return {
+        "query": q,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "results": [
+            {
+                "question_id": question.id,
+                "paper_id": question.paper_id,
+                "order_index": question.order_index,
+                "snippet": search.snippet(question.ocr_text, q),
+                "answer": question.answer,
+                "score": round(score, 4),
+            }
+            for question, score in hits
+        ],
+    }
@@ -0,0 +1,195 @@
+import os
+import time
+import threading
+from concurrent.futures import CancelledError
+from datetime import datetime
+
+from .. import models
+from ..database import SessionLocal
+from ..prompts import SOLVER_PROMPT_VERSION, SOLVER_SYSTEM_PROMPT, SOLVER_USER_PROMPT
+from . import cancellation, llm, routing, scheduler, solutions
+
+RATE_PER_MINUTE = float(os.getenv("BACKFILL_RATE_PER_MINUTE", "6"))
+TOKEN_BUDGET = int(os.getenv("BACKFILL_TOKEN_BUDGET", "200000"))
+SCAN_BATCH = 50
+# How long to back off while interactive/fresh-upload work is queued or running
+IDLE_POLL_SECONDS = 2.0
+
+
+class BackfillRunner:
+    """
+    Re-solves questions whose current solution is stale (new prompt version, model no longer
+    configured, text changed) in the background.
+
+    - Throttled to `rate_per_minute` solves and stopped once `token_budget` (estimated) is spent.
+    - Yields to live traffic: it only starts a solve when no INTERACTIVE or FRESH_UPLOAD task is
+      queued or running in the LLM lane, and submits at BACKFILL priority.
+    - Checkpoints the last scanned question id in backfill_runs, so a restart resumes there.
+    """
+
+    def __init__(self, session_factory=SessionLocal, sleep=time.sleep):
+        self.session_factory = session_factory
+        self.sleep = sleep
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.run_id = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, rate_per_minute: float = None, token_budget: int = None) -> int:
+        with self._lock:
+            if self.is_running():
+                return self.run_id
+
+            db = self.session_factory()
+            try:
+                # Resume an unfinished run for the same prompt version, else start a new one
+                run = db.query(models.BackfillRun).filter(
+                    models.BackfillRun.prompt_version == SOLVER_PROMPT_VERSION,
+                    models.BackfillRun.status.in_(["running", "stopped", "budget_exhausted", "failed"])
+                ).order_by(models.BackfillRun.id.desc()).first()
+                if run is None:
+                    run = models.BackfillRun(
+                        prompt_version=SOLVER_PROMPT_VERSION, last_question_id=0,
+                        solved=0, skipped=0, failed=0, tokens_used=0
+                    )
+                    db.add(run)
+                run.status = "running"
+                run.token_budget = run.tokens_used + (token_budget or TOKEN_BUDGET)
+                db.commit()
+                self.run_id = run.id
+            finally:
+                db.close()
+
+            self._stop.clear()
+            interval = 60.0 / (rate_per_minute or RATE_PER_MINUTE)
+            self._thread = threading.Thread(
+                target=self._run, args=(self.run_id, interval), name="backfill", daemon=True
+            )
+            self._thread.start()
+            return self.run_id
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self, db) -> dict:
+        query = db.query(models.BackfillRun)
+        run = query.filter(models.BackfillRun.id == self.run_id).first() if self.run_id else \
+            query.order_by(models.BackfillRun.id.desc()).first()
+        if run is None:
+            return {"status": "idle"}
+        return {
+            "run_id": run.id,
+            "status": run.status,
+            "prompt_version": run.prompt_version,
+            "last_question_id": run.last_question_id,
+            "solved": run.solved,
+            "skipped": run.skipped,
+            "failed": run.failed,
+            "tokens_used": run.tokens_used,
+            "token_budget": run.token_budget,
+        }
+
+    def _wait_for_idle_lane(self):
+        while not self._stop.is_set() and scheduler.llm.pending(max_priority=scheduler.FRESH_UPLOAD) > 0:
+            self.sleep(IDLE_POLL_SECONDS)
+
+    def _run(self, run_id: int, interval: float):
+        db = self.session_factory()
+        try:
+            run = db.query(models.BackfillRun).filter(models.BackfillRun.id == run_id).first()
+            last_start = 0.0
+            while not self._stop.is_set():
+                stale, skipped, last_id = solutions.scan_stale(db, run.last_question_id, SCAN_BATCH)
+                if last_id is None:
+                    run.status = "completed"
+                    break
+                run.skipped += skipped
+
+                # Ids, not instances: a rollback below expires them, and a deleted row can't reload
+                for question_id in [q.id for q in stale]:
+                    if self._stop.is_set():
+                        break
+                    if run.tokens_used >= run.token_budget:
+                        run.status = "budget_exhausted"
+                        db.commit()
+                        return
+
+                    self._wait_for_idle_lane()
+                    wait = last_start + interval - time.monotonic()
+                    if wait > 0:
+                        self.sleep(wait)
+                    if self._stop.is_set():
+                        break
+                    last_start = time.monotonic()
+
+                    q = db.get(models.Question, question_id)
+                    if q is None:
+                        # Its paper was deleted since this chunk was scanned
+                        run.skipped += 1
+                        run.last_question_id = question_id
+                        db.commit()
+                        continue
+                    # Deleting or re-processing the paper cancels this, like its other queued work
+                    token = cancellation.token_for(cancellation.paper_scope(q.paper_id))
+                    prompt_tokens = llm.estimate_tokens(SOLVER_SYSTEM_PROMPT + SOLVER_USER_PROMPT + q.ocr_text)
+                    try:
+                        result = scheduler.llm.run(
+                            routing.solve_question, q.ocr_text,
+                            priority=scheduler.BACKFILL, user="backfill", cancel_token=token
+                        )
+                        token.raise_if_cancelled()
+                        if solutions.is_failed(result):
+                            # Provider outage, missing key...: keep the existing answer
+                            raise RuntimeError(result.get("analysis") or "empty solution")
+                        solutions.record_solution(db, q, result)
+                        run.solved += 1
+                        run.tokens_used += prompt_tokens + llm.estimate_tokens(
+                            result.get("answer", "") + result.get("analysis", "")
+                        )
+                        # Inside the try: a question deleted meanwhile fails here, not the whole run
+                        db.commit()
+                    except CancelledError:
+                        db.rollback()
+                        print(f"Backfill skipped Q{question_id}: paper deleted or re-processed")
+                        run.skipped += 1
+                    except Exception as e:
+                        db.rollback()
+                        print(f"Backfill failed for Q{question_id}: {e}")
+                        run.failed += 1
+                        run.tokens_used += prompt_tokens
+                    finally:
+                        cancellation.release(token)
+                    # Checkpoint after every question
+                    run.last_question_id = question_id
+                    db.commit()
+                else:
+                    # Whole chunk handled (including the up-to-date ones after the last stale id)
+                    run.last_question_id = last_id
+                    db.commit()
+                    continue
+                break
+
+            if self._stop.is_set() and run.status == "running":
+                run.status = "stopped"
+            run.updated_at = datetime.utcnow()
+            db.commit()
+        except Exception as e:
+            print(f"Backfill run {run_id} crashed: {e}")
+            db.rollback()
+            run = db.query(models.BackfillRun).filter(models.BackfillRun.id == run_id).first()
+            if run is not None:
+                run.status = "failed"
+                run.updated_at = datetime.utcnow()
+                db.commit()
+        finally:
+            db.close()
+
+
+runner = BackfillRunner()
@@ -0,0 +1,287 @@
+import os
+import io
+import json
+import time
+import threading
+from langchain_core.prompts import ChatPromptTemplate
+from openai import OpenAI
+
+from .. import models
+from ..database import SessionLocal
+from ..prompts import SOLVER_SYSTEM_PROMPT, SOLVER_USER_PROMPT, SOLVER_PROMPT_VERSION
+from ..prompts import FORMATTER_SYSTEM_PROMPT, FORMATTER_USER_PROMPT
+from . import routing, solutions, structured
+
+# Offline mode for bulk, non-urgent work (imported question banks, overnight re-solves):
+# requests are written to a JSONL file for an OpenAI-compatible /v1/batches endpoint instead
+# of going through the LLM lane one chain.invoke at a time. Nothing is held open while the
+# provider works; a poller checks back every BATCH_POLL_SECONDS and writes results back.
+
+POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "60"))
+MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "1000"))
+COMPLETION_WINDOW = "24h"
+ENDPOINT = "/v1/chat/completions"
+
+# Jobs still waiting on the provider (a completed job whose results weren't applied yet counts too)
+OPEN_STATUSES = ("validating", "in_progress", "finalizing", "cancelling", "completed")
+# Terminal statuses that can still carry output for the requests that did finish
+FINISHED_STATUSES = ("completed", "expired", "cancelled")
+
+KINDS = {
+    # kind: (system prompt, user prompt, prompt variable, temperature, schema)
+    "solve": (SOLVER_SYSTEM_PROMPT, SOLVER_USER_PROMPT, "question", 0.3, structured.SolutionOutput),
+    "format": (FORMATTER_SYSTEM_PROMPT, FORMATTER_USER_PROMPT, "text", 0.1, structured.FormatOutput),
+}
+
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+def client() -> OpenAI:
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_API_BASE"))
+
+
+def custom_id(kind: str, question) -> str:
+    # The text hash makes results for an edited question recognisable as stale
+    return f"{kind}:{question.id}:{solutions.input_hash(question.ocr_text)[:16]}"
+
+
+def parse_custom_id(value: str):
+    kind, question_id, text_hash = value.split(":")
+    return kind, int(question_id), text_hash
+
+
+def build_request(kind: str, question, model: str) -> dict:
+    """
+    One JSONL line: the same messages the synchronous path sends, rendered from the shared prompts.
+    """
+    system_prompt, user_prompt, variable, temperature, _ = KINDS[kind]
+    messages = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        ("user", user_prompt)
+    ]).format_messages(**{variable: question.ocr_text})
+
+    body = {
+        "model": model,
+        "messages": [{"role": _ROLES[m.type], "content": m.content} for m in messages],
+        "temperature": temperature,
+    }
+    if structured.json_mode_enabled(model):
+        body["response_format"] = {"type": "json_object"}
+    return {"custom_id": custom_id(kind, question), "method": "POST", "url": ENDPOINT, "body": body}
+
+
+def _queued_question_ids(db, kind: str) -> set:
+    queued = set()
+    jobs = db.query(models.BatchJob.question_ids).filter(
+        models.BatchJob.kind == kind, models.BatchJob.status.in_(OPEN_STATUSES)
+    )
+    for (ids,) in jobs:
+        queued.update(json.loads(ids or "[]"))
+    return queued
+
+
+def collect_stale(db, limit: int = MAX_REQUESTS) -> list:
+    """
+    Questions whose current solution is stale (same rules as the backfill), not already queued.
+    """
+    queued = _queued_question_ids(db, "solve")
+    collected, after_id = [], 0
+    while len(collected) < limit:
+        stale, _, last_id = solutions.scan_stale(db, after_id, 200)
+        if last_id is None:
+            break
+        collected.extend(q for q in stale if q.id not in queued)
+        after_id = last_id
+    return collected[:limit]
+
+
+def submit(db, kind: str, questions: list):
+    """
+    Uploads one JSONL batch for `questions` and records it. Returns the BatchJob, or None if
+    there was nothing to send.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown batch kind: {kind}")
+    queued = _queued_question_ids(db, kind)
+    questions = [q for q in questions if q.ocr_text and q.id not in queued][:MAX_REQUESTS]
+    if not questions:
+        return None
+
+    model = routing.batch_model()
+    lines = [json.dumps(build_request(kind, q, model), ensure_ascii=False) for q in questions]
+    payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+    api = client()
+    input_file = api.files.create(file=(f"qsnap-{kind}.jsonl", io.BytesIO(payload)), purpose="batch")
+    provider_batch = api.batches.create(
+        input_file_id=input_file.id, endpoint=ENDPOINT, completion_window=COMPLETION_WINDOW,
+        metadata={"source": "qsnap", "kind": kind},
+    )
+
+    job = models.BatchJob(
+        kind=kind,
+        provider_batch_id=provider_batch.id,
+        input_file_id=input_file.id,
+        model=model,
+        prompt_version=SOLVER_PROMPT_VERSION if kind == "solve" else "",
+        question_ids=json.dumps([q.id for q in questions]),
+        status=provider_batch.status or "validating",
+        request_count=len(questions),
+        applied=0, skipped=0, failed=0,
+    )
+    db.add(job)
+    db.commit()
+    print(f"Submitted {kind} batch {provider_batch.id}: {len(questions)} requests")
+    return job
+
+
+def _apply_solve(db, job, question, content: str) -> str:
+    current = db.query(models.Solution).filter(
+        models.Solution.question_id == question.id,
+        models.Solution.is_current == True  # noqa: E712
+    ).first()
+    text_hash = solutions.input_hash(question.ocr_text)
+    if current is not None and (current.input_hash, current.model, current.prompt_version) == \
+            (text_hash, job.model, job.prompt_version):
+        # Already written back by an earlier refresh of this job
+        return "skipped"
+
+    solution = structured.parse(content, structured.SolutionOutput)
+    solutions.record_solution(db, question, {**solution.model_dump(), "model": job.model}, job.prompt_version)
+    return "applied"
+
+
+def _apply_format(db, job, question, content: str) -> str:
+    result = structured.parse(content, structured.FormatOutput)
+    question.ocr_text = result.formatted_text
+    question.is_incomplete = not result.is_complete
+    return "applied"
+
+
+def apply_results(db, job, output: str) -> dict:
+    """
+    Writes a finished batch's output back to its questions.
+
+    Idempotent: a result is only applied if the question still has the text it was generated
+    for (the hash in custom_id), and solve results already recorded are skipped, so applying
+    the same output twice changes nothing.
+    """
+    counts = {"applied": 0, "skipped": 0, "failed": 0}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            kind, question_id, text_hash = parse_custom_id(item["custom_id"])
+        except (ValueError, KeyError, TypeError) as e:
+            # One bad line must not block the rest of the job (the poller would retry it forever)
+            print(f"Batch {job.provider_batch_id}: unreadable output line: {e}")
+            counts["failed"] += 1
+            continue
+        question = db.query(models.Question).filter(models.Question.id == question_id).first()
+        if question is None or solutions.input_hash(question.ocr_text)[:16] != text_hash:
+            # Deleted or edited since submission: the result answers a question that no longer exists
+            counts["skipped"] += 1
+            continue
+
+        response = item.get("response") if isinstance(item.get("response"), dict) else {}
+        if item.get("error") or response.get("status_code") != 200:
+            error = item.get("error") or response.get("body")
+            if "response_format" in str(error) and structured.json_mode_enabled(job.model):
+                # The next batch goes without JSON mode; these questions stay stale and are resent
+                structured.disable_json_mode(job.model)
+            print(f"Batch {job.provider_batch_id} request {item['custom_id']} failed: {error}")
+            counts["failed"] += 1
+            continue
+
+        try:
+            content = response["body"]["choices"][0]["message"]["content"]
+            apply = _apply_solve if kind == "solve" else _apply_format
+            counts[apply(db, job, question, content)] += 1
+        except (KeyError, IndexError, TypeError) as e:
+            print(f"Batch result for Q{question_id} has no message content: {e!r}")
+            counts["failed"] += 1
+        except structured.StructuredOutputError as e:
+            # Left stale, so the next batch or the backfill picks it up again
+            print(f"Batch result for Q{question_id} unusable: {e}")
+            counts["failed"] += 1
+    return counts
+
+
+def refresh(db, job):
+    """
+    Polls the provider for one job and applies its results once it has completed.
+    """
+    if job.status not in OPEN_STATUSES:
+        return job
+
+    api = client()
+    provider_batch = api.batches.retrieve(job.provider_batch_id)
+    job.status = provider_batch.status
+    job.output_file_id = provider_batch.output_file_id
+    job.error_file_id = provider_batch.error_file_id
+
+    if job.status in FINISHED_STATUSES:
+        output = ""
+        for file_id in (job.output_file_id, job.error_file_id):
+            if file_id:
+                output += api.files.content(file_id).text + "\n"
+        counts = apply_results(db, job, output)
+        job.applied, job.skipped, job.failed = counts["applied"], counts["skipped"], counts["failed"]
+        if job.status == "completed":
+            job.status = "applied"
+        print(f"Applied batch {job.provider_batch_id}: {counts}")
+    db.commit()
+    return job
+
+
+def refresh_open(db) -> int:
+    """
+    Refreshes every unfinished job. Returns how many are still waiting on the provider.
+    """
+    waiting = 0
+    for job in db.query(models.BatchJob).filter(models.BatchJob.status.in_(OPEN_STATUSES)).all():
+        try:
+            refresh(db, job)
+        except Exception as e:
+            db.rollback()
+            print(f"Error refreshing batch {job.provider_batch_id}: {e}")
+        if job.status in OPEN_STATUSES:
+            waiting += 1
+    return waiting
+
+
+class BatchPoller:
+    """
+    Background thread that refreshes open jobs every POLL_SECONDS and exits when none are left.
+    """
+
+    def __init__(self, session_factory=SessionLocal, sleep=time.sleep):
+        self.session_factory = session_factory
+        self.sleep = sleep
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="batch-poller", daemon=True)
+            self._thread.start()
+
+    def join(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            self.sleep(POLL_SECONDS)
+            db = self.session_factory()
+            try:
+                if refresh_open(db) == 0:
+                    return
+            finally:
+                db.close()
+
+
+poller = BatchPoller()
@@ -0,0 +1,94 @@
+import threading
+from concurrent.futures import CancelledError
+
+
+class CancelToken:
+    """
+    Cooperative cancellation flag for all the work belonging to one scope (e.g. a paper).
+
+    Queued scheduler tasks registered with track() are cancelled outright; work that is already
+    running is expected to check `cancelled` (or call raise_if_cancelled) between steps.
+    """
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._futures = []
+        self._holders = 0  # token_for()/retain() calls not yet matched by release()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.cancel()
+
+    def track(self, future):
+        with self._lock:
+            if not self.cancelled:
+                self._futures = [f for f in self._futures if not f.done()]
+                self._futures.append(future)
+                return future
+        future.cancel()
+        return future
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise CancelledError()
+
+
+_lock = threading.Lock()
+_tokens = {}
+
+
+def token_for(scope) -> CancelToken:
+    """
+    The live token for a scope, created on first use. Each call holds it until release(), so the
+    scope's entry is dropped once the work using it has finished.
+    """
+    with _lock:
+        token = _tokens.get(scope)
+        if token is None:
+            token = _tokens[scope] = CancelToken(scope)
+        token._holders += 1
+        return token
+
+
+def retain(token: CancelToken) -> CancelToken:
+    """
+    One more hold on a token, for work handed to another task (e.g. a queued solve).
+    """
+    with _lock:
+        token._holders += 1
+    return token
+
+
+def release(token: CancelToken):
+    """
+    Drops one hold; the scope forgets its token when nothing holds it any more.
+    """
+    if token is None:
+        return
+    with _lock:
+        token._holders -= 1
+        if token._holders <= 0 and _tokens.get(token.scope) is token:
+            del _tokens[token.scope]
+
+
+def cancel(scope):
+    """
+    Cancels everything queued or running for the scope. The next token_for() starts fresh.
+    """
+    with _lock:
+        token = _tokens.pop(scope, None)
+    if token is not None:
+        token.cancel()
+
+
+def paper_scope(paper_id: int):
+    return ("paper", paper_id)
@@ -0,0 +1,167 @@
+import os
+import hashlib
+import threading
+import cv2
+import numpy as np
+
+# Derivatives live outside static/ so they are only served through the image endpoint
+CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "cache/images")
+CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_MB", "256")) * 1024 * 1024
+# An eviction pass trims to this share of the limit, so the next few misses don't trigger another
+EVICT_TO_RATIO = 0.9
+
+# Requested widths are rounded up to one of these so the cache holds a bounded set of variants
+WIDTH_BUCKETS = (160, 320, 480, 640, 960, 1280, 1920)
+
+FORMATS = {
+    "webp": ("image/webp", ".webp", cv2.IMWRITE_WEBP_QUALITY, 80),
+    "jpeg": ("image/jpeg", ".jpg", cv2.IMWRITE_JPEG_QUALITY, 82),
+}
+
+_digests = {}
+_lock = threading.Lock()
+# Cache dir -> bytes on disk: counted by one scan, then kept up to date as derivatives are written
+_cache_bytes = {}
+
+
+def file_digest(path: str) -> str:
+    """
+    Content hash of a stored file, memoized on (mtime, size) so it's only hashed once.
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _digests.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    value = digest.hexdigest()[:16]
+
+    with _lock:
+        _digests[path] = (signature, value)
+    return value
+
+
+def bucket_width(width: int = None):
+    if not width:
+        return None
+    for bucket in WIDTH_BUCKETS:
+        if width <= bucket:
+            return bucket
+    return WIDTH_BUCKETS[-1]
+
+
+def parse_bbox(value) -> list[int]:
+    """
+    Accepts "x,y,w,h", a JSON list string or a list. Empty means the whole image.
+    """
+    if not value or value == "[]":
+        return []
+    if isinstance(value, str):
+        value = value.strip("[] ").split(",")
+    bbox = [int(float(v)) for v in value]
+    if len(bbox) != 4:
+        raise ValueError("bbox must be x,y,w,h")
+    return bbox
+
+
+def derivative_key(source_digest: str, bbox: list[int], width, fmt: str) -> str:
+    """
+    Identifies one rendered variant. It changes whenever the original's bytes change,
+    which is what makes URLs containing it safe to cache forever.
+    """
+    raw = f"{source_digest}|{','.join(map(str, bbox))}|{width or 0}|{fmt}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def render(source_path: str, bbox: list[int], width, fmt: str) -> str:
+    """
+    Returns the path of the cached derivative (crop of `bbox`, resized to `width`),
+    rendering it from the original on first request.
+    """
+    key = derivative_key(file_digest(source_path), bbox, width, fmt)
+    _, extension, quality_flag, quality = FORMATS[fmt]
+    cache_path = os.path.join(CACHE_DIR, key[:2], key + extension)
+
+    if os.path.exists(cache_path):
+        # Touch for LRU eviction
+        os.utime(cache_path, None)
+        return cache_path
+
+    img = cv2.imdecode(np.fromfile(source_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Could not read image at {source_path}")
+
+    if bbox:
+        x, y, w, h = bbox
+        x, y = max(0, x), max(0, y)
+        img = img[y:y + h, x:x + w]
+        if img.size == 0:
+            raise ValueError("bbox is outside the image")
+
+    if width and img.shape[1] > width:
+        height = max(1, round(img.shape[0] * width / img.shape[1]))
+        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+
+    ok, encoded = cv2.imencode(extension, img, [quality_flag, quality])
+    if not ok:
+        raise ValueError(f"Could not encode {fmt}")
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Write then rename so a concurrent reader never sees a partial file
+    tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    encoded.tofile(tmp_path)
+    os.replace(tmp_path, cache_path)
+
+    _account(len(encoded))
+    return cache_path
+
+
+def _account(size: int):
+    """
+    Adds a newly written derivative to the running cache size. The cache directory is only
+    walked the first time and when the total crosses CACHE_MAX_BYTES, not on every miss.
+    """
+    with _lock:
+        total = _cache_bytes.get(CACHE_DIR)
+        if total is not None:
+            total = _cache_bytes[CACHE_DIR] = total + size
+    if total is None or total > CACHE_MAX_BYTES:
+        evict(target_bytes=int(CACHE_MAX_BYTES * EVICT_TO_RATIO))
+
+
+def evict(max_bytes: int = None, target_bytes: int = None):
+    """
+    If the cache is over max_bytes, deletes least recently used derivatives until it fits in
+    target_bytes (default: max_bytes). Resyncs the running size used by render().
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    target_bytes = max_bytes if target_bytes is None else min(target_bytes, max_bytes)
+    entries = []
+    total = 0
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total > max_bytes:
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= target_bytes:
+                break
+
+    with _lock:
+        _cache_bytes[CACHE_DIR] = total
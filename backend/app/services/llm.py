@@ -2,47 +2,93 @@ import os
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
+from langchain_core.output_parsers import StrOutputParser
 from ..prompts import SOLVER_SYSTEM_PROMPT, SOLVER_USER_PROMPT, SPLITTER_SYSTEM_PROMPT, SPLITTER_USER_PROMPT
+from ..prompts import FORMATTER_SYSTEM_PROMPT, FORMATTER_USER_PROMPT, REPAIR_USER_PROMPT
+from . import structured
 
 # Ensure environment variables are loaded
 # Using override=True to ensure .env values are used even if local env vars exist
 load_dotenv(override=True)
 
-def solve_question(question_text: str):
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count without a tokenizer: one per CJK character, ~4 characters per token otherwise.
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '\u4e00' <= ch <= '\u9fff' or '\u3000' <= ch <= '\u303f' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
+
+def _chat(model_name: str, temperature: float, json_mode: bool = False):
+    llm = ChatOpenAI(
+        model=model_name,
+        base_url=os.getenv("OPENAI_API_BASE"), # Modern parameter name
+        api_key=os.getenv("OPENAI_API_KEY"),   # Explicitly pass the key
+        temperature=temperature
+    )
+    if json_mode:
+        # Provider-side JSON mode: the reply is guaranteed to be a JSON object
+        llm = llm.bind(response_format={"type": "json_object"})
+    return llm
+
+def _invoke_structured(system_prompt: str, user_prompt: str, variables: dict, schema,
+                       model_name: str, temperature: float):
+    """
+    One structured LLM call through services/structured: local extraction and repair first,
+    a single corrective follow-up only if that fails. Raises StructuredOutputError.
+    """
+    def run(feedback):
+        messages = [("system", system_prompt), ("user", user_prompt)]
+        inputs = dict(variables)
+        if feedback:
+            # Raw output goes in as a variable: its braces must not be read as template fields
+            messages += [("ai", "{previous_output}"), ("user", REPAIR_USER_PROMPT)]
+            inputs.update(previous_output=feedback[0], error=feedback[1])
+        prompt = ChatPromptTemplate.from_messages(messages)
+
+        json_mode = structured.json_mode_enabled(model_name)
+        chain = prompt | _chat(model_name, temperature, json_mode) | StrOutputParser()
+        try:
+            return chain.invoke(inputs)
+        except Exception as e:
+            if json_mode and structured.is_json_mode_error(e):
+                print(f"JSON mode not supported by {model_name}, disabling it")
+                structured.disable_json_mode(model_name)
+                return run(feedback)
+            raise
+
+    return structured.generate(run, schema)
+
+def solve_question(question_text: str, model: str = None) -> dict:
     """
     Generates a solution for the given question text.
+    `model` overrides LLM_MODEL (used by services/routing to pick a tier).
+    Returns {"answer", "analysis"}; on failure the answer is empty, the analysis says what went
+    wrong and "error" is True.
     """
     if not question_text:
-        return "No question text provided."
+        return {"answer": "", "analysis": "No question text provided.", "error": True}
 
     # Force reloading environment to be absolutely sure
     api_key = os.getenv("OPENAI_API_KEY")
-    base_url = os.getenv("OPENAI_API_BASE")
-    model_name = os.getenv("LLM_MODEL", "deepseek-ai/DeepSeek-V3")
+    model_name = model or os.getenv("LLM_MODEL", "deepseek-ai/DeepSeek-V3")
 
     if not api_key:
-        return "Error: OPENAI_API_KEY not found in environment."
+        return {"answer": "", "analysis": "Error: OPENAI_API_KEY not found in environment.", "error": True}
 
     try:
-        # Using explicit parameters for better compatibility
-        llm = ChatOpenAI(
-            model=model_name, 
-            base_url=base_url, # Modern parameter name
-            api_key=api_key,   # Explicitly pass the key
-            temperature=0.3
+        solution = _invoke_structured(
+            SOLVER_SYSTEM_PROMPT, SOLVER_USER_PROMPT, {"question": question_text},
+            structured.SolutionOutput, model_name, 0.3
         )
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", SOLVER_SYSTEM_PROMPT),
-            ("user", SOLVER_USER_PROMPT)
-        ])
-        
-        chain = prompt | llm | StrOutputParser()
-        
-        return chain.invoke({"question": question_text})
+        return solution.model_dump()
+    except structured.StructuredOutputError as e:
+        # Even the retry wasn't JSON: keep the text as the analysis, it's usually still a solution
+        print(f"Solver output not structured: {e}")
+        return {"answer": "", "analysis": str(e.raw).strip()}
     except Exception as e:
-        return f"Error generating solution: {str(e)}"
+        return {"answer": "", "analysis": f"Error generating solution: {str(e)}", "error": True}
 
 def split_text_into_questions(full_text: str) -> list[str]:
     """
@@ -53,7 +99,6 @@ def split_text_into_questions(full_text: str) -> list[str]:
 
     # Force reloading environment
     api_key = os.getenv("OPENAI_API_KEY")
-    base_url = os.getenv("OPENAI_API_BASE")
     model_name = os.getenv("LLM_MODEL", "deepseek-ai/DeepSeek-V3")
 
     if not api_key:
@@ -61,32 +106,160 @@ def split_text_into_questions(full_text: str) -> list[str]:
         return [full_text]
 
     try:
-        llm = ChatOpenAI(
-            model=model_name, 
-            base_url=base_url,
-            api_key=api_key,
-            temperature=0.1
+        result = _invoke_structured(
+            SPLITTER_SYSTEM_PROMPT, SPLITTER_USER_PROMPT, {"text": full_text},
+            structured.SplitOutput, model_name, 0.1
         )
-        
+        return result.questions
+    except Exception as e:
+        print(f"Error splitting text: {str(e)}")
+        # Simple heuristic fallback
+        return [chunk.strip() for chunk in full_text.split('\n\n') if chunk.strip()]
+
+class QuestionStreamParser:
+    """
+    Incremental parser for the splitter's JSON output ({"questions": ["...", ...]} or a bare list).
+
+    feed() takes raw chunks as they stream in and returns the questions that were completed
+    by that chunk, so each one can be handled before the rest of the response has arrived.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._stack = []          # open containers: "{" or "["
+        self._array_depth = None  # depth of the questions array once seen
+        self._in_string = False
+        self._escaped = False
+        self._start = None        # buffer index where the current element started
+        self.emitted = 0
+
+    def _at_element_level(self) -> bool:
+        return self._array_depth is not None and len(self._stack) == self._array_depth
+
+    def feed(self, chunk: str) -> list[str]:
+        self.buffer += chunk
+        completed = []
+        while self._pos < len(self.buffer):
+            i, ch = self._pos, self.buffer[self._pos]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._at_element_level() and self._start is not None:
+                        completed.extend(self._element(self.buffer[self._start:i + 1]))
+                        self._start = None
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._at_element_level():
+                    self._start = i
+            elif ch in "{[":
+                if ch == "{" and self._at_element_level():
+                    self._start = i
+                self._stack.append(ch)
+                if ch == "[" and self._array_depth is None:
+                    self._array_depth = len(self._stack)
+            elif ch in "}]" and self._stack:
+                self._stack.pop()
+                if ch == "}" and self._at_element_level() and self._start is not None:
+                    completed.extend(self._element(self.buffer[self._start:i + 1]))
+                    self._start = None
+
+        self.emitted += len(completed)
+        return completed
+
+    @staticmethod
+    def _element(raw: str) -> list[str]:
+        try:
+            # Tolerates LaTeX backslashes the model forgot to escape
+            value = structured.loads(raw)
+        except structured.StructuredOutputError:
+            return []
+        if isinstance(value, dict):
+            # Some models wrap items: {"question": "..."} / {"text": "..."}
+            value = value.get("question") or value.get("text") or ""
+        value = str(value).strip()
+        return [value] if value else []
+
+def stream_split_questions(full_text: str):
+    """
+    Streaming variant of split_text_into_questions: yields each question as soon as
+    its JSON string is complete in the LLM output.
+    Raises if the stream breaks after some questions were yielded.
+    """
+    if not full_text:
+        return
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    model_name = os.getenv("LLM_MODEL", "deepseek-ai/DeepSeek-V3")
+
+    if not api_key:
+        print("Error: OPENAI_API_KEY not found.")
+        yield full_text
+        return
+
+    parser = QuestionStreamParser()
+    try:
         prompt = ChatPromptTemplate.from_messages([
             ("system", SPLITTER_SYSTEM_PROMPT),
             ("user", SPLITTER_USER_PROMPT)
         ])
-        
-        chain = prompt | llm | JsonOutputParser()
-        
-        result = chain.invoke({"text": full_text})
-        
-        if isinstance(result, dict) and "questions" in result:
-             # Ensure items are strings
-             return [str(q) for q in result["questions"]]
-        elif isinstance(result, list):
-             return [str(q) for q in result]
-        
-        print(f"Unexpected split format: {type(result)}")
-        return [full_text] 
-        
+
+        # No JSON mode here: it is the one call that must keep streaming if the provider objects
+        chain = prompt | _chat(model_name, 0.1) | StrOutputParser()
+
+        for chunk in chain.stream({"text": full_text}):
+            yield from parser.feed(chunk)
     except Exception as e:
-        print(f"Error splitting text: {str(e)}")
-        # Simple heuristic fallback
-        return [chunk.strip() for chunk in full_text.split('\n\n') if chunk.strip()]
+        print(f"Error streaming split: {str(e)}")
+        if parser.emitted:
+            # Questions were already handed out: falling back now would duplicate them, and
+            # stopping quietly would pass a partial paper off as complete
+            raise
+
+    if parser.emitted == 0 and parser.buffer.strip():
+        # The stream parser needs well-formed strings; try the full local repair before giving up
+        try:
+            questions = structured.parse(parser.buffer, structured.SplitOutput).questions
+            parser.emitted = len(questions)
+            yield from questions
+        except structured.StructuredOutputError as e:
+            print(f"Streamed split output unusable: {e}")
+
+    if parser.emitted == 0:
+        # Nothing usable came out of the stream: same fallback as the blocking splitter
+        print("Streaming split produced no questions, falling back to paragraph split")
+        yield from [chunk.strip() for chunk in full_text.split('\n\n') if chunk.strip()]
+
+def format_and_check_question(question_text: str) -> dict:
+    """
+    Cleans up a single question's OCR text and checks whether it is complete.
+    Returns {"formatted_text": str, "is_complete": bool}; the input is kept unchanged on failure.
+    """
+    fallback = {"formatted_text": question_text, "is_complete": True}
+    if not question_text:
+        return fallback
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    model_name = os.getenv("LLM_MODEL", "deepseek-ai/DeepSeek-V3")
+
+    if not api_key:
+        print("Error: OPENAI_API_KEY not found.")
+        return fallback
+
+    try:
+        result = _invoke_structured(
+            FORMATTER_SYSTEM_PROMPT, FORMATTER_USER_PROMPT, {"text": question_text},
+            structured.FormatOutput, model_name, 0.1
+        )
+        return result.model_dump()
+    except Exception as e:
+        print(f"Error formatting question: {str(e)}")
+        return fallback
@@ -0,0 +1,160 @@
+import os
+import re
+from dataclasses import dataclass, field
+from statistics import median
+
+from .llm import estimate_tokens
+
+# Deterministic cleanup of raw EasyOCR output before it reaches any LLM prompt.
+# Every line removed here is removed from the splitter, formatter and solver prompts.
+
+# Below this confidence, short fragments are treated as noise (long lines are kept: they're content)
+MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "0.3"))
+NOISE_MAX_CHARS = 2
+# Top/bottom share of the page where headers, footers and page numbers live
+MARGIN_RATIO = 0.08
+
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_PUNCTUATION_ONLY = re.compile(r"^[\W_]+$")
+_PAGE_NUMBER = re.compile(
+    r"^(第\s*\d+\s*页(\s*[,，/]?\s*共\s*\d+\s*页)?|[-—\s]*\d{1,3}[-—\s]*|\d{1,3}\s*/\s*\d{1,3}|page\s*\d+(\s*of\s*\d+)?)$",
+    re.IGNORECASE,
+)
+_SCORE_WORDS = re.compile(r"得\s*分|评\s*卷\s*人|阅\s*卷\s*人|评\s*分\s*人|核\s*分\s*人|复\s*核\s*人|题\s*号|总\s*分|分\s*数")
+_SCORE_FILLER = re.compile(r"[\s\d一二三四五六七八九十|｜:：_\-—()（）]+")
+# A line starting like this begins a new question/option, so it is never glued onto the previous one
+_ITEM_START = re.compile(r"^(\d{1,3}\s*[.．、]|[（(]\s*\d{1,3}\s*[)）]|[A-HＡ-Ｈ]\s*[.．、:：]|[一二三四五六七八九十]+\s*[、.．])")
+
+
+@dataclass
+class OCRLine:
+    text: str
+    confidence: float
+    left: float
+    top: float
+    right: float
+    bottom: float
+
+    @property
+    def height(self) -> float:
+        return self.bottom - self.top
+
+    @property
+    def center(self) -> float:
+        return (self.top + self.bottom) / 2
+
+
+@dataclass
+class NormalizedPage:
+    text: str
+    tokens_before: int
+    tokens_after: int
+    dropped: dict = field(default_factory=dict)  # reason -> number of lines
+
+
+def to_lines(results) -> list[OCRLine]:
+    """
+    EasyOCR readtext(detail=1) results -> OCRLine, i.e. [([[x, y] * 4], text, confidence), ...]
+    """
+    lines = []
+    for box, text, confidence in results:
+        xs = [float(p[0]) for p in box]
+        ys = [float(p[1]) for p in box]
+        lines.append(OCRLine(str(text).strip(), float(confidence), min(xs), min(ys), max(xs), max(ys)))
+    return lines
+
+
+def is_noise(line: OCRLine) -> bool:
+    if not line.text or _PUNCTUATION_ONLY.match(line.text):
+        return True
+    return line.confidence < MIN_CONFIDENCE and len(line.text) <= NOISE_MAX_CHARS
+
+
+def in_margin(line: OCRLine, page_height: float) -> bool:
+    return line.top < page_height * MARGIN_RATIO or line.bottom > page_height * (1 - MARGIN_RATIO)
+
+
+def is_page_number(line: OCRLine, page_height: float) -> bool:
+    return in_margin(line, page_height) and bool(_PAGE_NUMBER.match(line.text))
+
+
+def is_score_box(line: OCRLine) -> bool:
+    """
+    Score table cells like "题号 一 二 三 总分" or "得分 评卷人": only score words, numerals and rules.
+    """
+    if not _SCORE_WORDS.search(line.text):
+        return False
+    return not _SCORE_FILLER.sub("", _SCORE_WORDS.sub("", line.text))
+
+
+def _join(left: str, right: str) -> str:
+    # Chinese is written without spaces; everything else keeps a word boundary
+    if _CJK.match(left[-1:]) or _CJK.match(right[:1]):
+        return left + right
+    return f"{left} {right}"
+
+
+def merge_lines(lines: list[OCRLine]) -> list[str]:
+    """
+    Rebuilds reading order from geometry: boxes whose vertical centers line up form one row
+    (left to right), and a row that wraps a sentence is glued onto the row above it.
+    """
+    if not lines:
+        return []
+    line_height = median(line.height for line in lines) or 1.0
+
+    rows = []
+    for line in sorted(lines, key=lambda l: (l.center, l.left)):
+        if rows and abs(line.center - rows[-1][0].center) < line_height / 2:
+            rows[-1].append(line)
+        else:
+            rows.append([line])
+
+    merged = []  # (text, left, bottom)
+    for row in rows:
+        row.sort(key=lambda l: l.left)
+        text = row[0].text
+        for line in row[1:]:
+            text = _join(text, line.text)
+        left, top, bottom = row[0].left, min(l.top for l in row), max(l.bottom for l in row)
+
+        if merged:
+            prev_text, prev_left, prev_bottom = merged[-1]
+            # Wrapped continuation: right below, not indented differently, not a new item
+            continues = (
+                top - prev_bottom < line_height * 0.6
+                and abs(left - prev_left) < line_height * 1.5
+                and not _ITEM_START.match(text)
+                and not prev_text.endswith(("。", "？", "?", "：", ":"))
+            )
+            if continues:
+                merged[-1] = (_join(prev_text, text), prev_left, bottom)
+                continue
+        merged.append((text, left, bottom))
+
+    return [text for text, _, _ in merged]
+
+
+def normalize_page(results, page_height: float = None) -> NormalizedPage:
+    """
+    Cleans one page of EasyOCR detail=1 results and reports the token saving.
+    """
+    lines = to_lines(results)
+    raw_text = "\n".join(line.text for line in lines)
+    if page_height is None:
+        page_height = max((line.bottom for line in lines), default=0)
+
+    dropped = {"noise": 0, "page_number": 0, "score_box": 0}
+    kept = []
+    for line in lines:
+        if is_noise(line):
+            dropped["noise"] += 1
+        elif is_page_number(line, page_height):
+            dropped["page_number"] += 1
+        elif is_score_box(line):
+            dropped["score_box"] += 1
+        else:
+            kept.append(line)
+
+    text = "\n".join(merge_lines(kept))
+    return NormalizedPage(text, estimate_tokens(raw_text), estimate_tokens(text), dropped)
@@ -0,0 +1,365 @@
+import os
+import time
+import argparse
+from abc import ABC, abstractmethod
+import cv2
+import easyocr
+import torch
+
+# Languages used by every backend (the recognizer weights depend on this list)
+LANGUAGES = ['ch_sim', 'en']
+
+DEFAULT_ONNX_MODEL = "models/recognizer_ch_sim.onnx"
+
+# Two-pass page OCR (see read_page): full = one pass at native resolution, adaptive = fast pass on a
+# downscaled page, then only low-confidence lines are re-recognized at native resolution
+FAST_MAX_SIDE = 1280
+RECHECK_CONFIDENCE = 0.5
+
+
+class OCREngine(ABC):
+    """
+    Common interface for OCR backends.
+    readtext() mirrors easyocr.Reader.readtext so callers don't care which backend is active.
+    An engine missing either method fails when it is constructed, not halfway through a page.
+    """
+    name = "base"
+
+    @abstractmethod
+    def readtext(self, image, detail=1, **kwargs):
+        ...
+
+    @abstractmethod
+    def recognize(self, grey, boxes: list, **kwargs):
+        """
+        Recognition only (no detection) of `boxes` ([x_min, x_max, y_min, y_max]) in a grey image.
+        Returns readtext-style (box, text, confidence) tuples.
+        """
+
+
+class EasyOCREngine(OCREngine):
+    """
+    Stock EasyOCR reader, exactly as the app has always created it.
+    """
+    name = "easyocr"
+
+    def __init__(self):
+        # gpu=False assumes no CUDA; change to True if user has NVIDIA GPU
+        self.reader = easyocr.Reader(LANGUAGES, gpu=False)
+
+    def readtext(self, image, detail=1, **kwargs):
+        return self.reader.readtext(image, detail=detail, **kwargs)
+
+    def recognize(self, grey, boxes: list, **kwargs):
+        return self.reader.recognize(grey, horizontal_list=boxes, free_list=[], detail=1, **kwargs)
+
+
+class QuantizedEasyOCREngine(EasyOCREngine):
+    """
+    CPU-tuned EasyOCR: int8 dynamic quantization of the recognizer (LSTM + Linear),
+    a smaller detector canvas and batched recognition.
+    """
+    name = "quantized"
+
+    def __init__(self):
+        threads = int(os.getenv("OCR_THREADS", "0"))
+        if threads > 0:
+            torch.set_num_threads(threads)
+
+        self.reader = easyocr.Reader(LANGUAGES, gpu=False, quantize=True)
+        quantize_recognizer(self.reader)
+
+        # CRAFT cost grows with the canvas area; 1280 is plenty for a phone photo of a page
+        self.canvas_size = int(os.getenv("OCR_CANVAS_SIZE", "1280"))
+        self.batch_size = int(os.getenv("OCR_BATCH_SIZE", "8"))
+
+    def readtext(self, image, detail=1, **kwargs):
+        kwargs.setdefault("canvas_size", self.canvas_size)
+        kwargs.setdefault("batch_size", self.batch_size)
+        return self.reader.readtext(image, detail=detail, **kwargs)
+
+    def recognize(self, grey, boxes: list, **kwargs):
+        kwargs.setdefault("batch_size", self.batch_size)
+        return super().recognize(grey, boxes, **kwargs)
+
+
+class _OnnxRecognizer(torch.nn.Module):
+    """
+    Drop-in replacement for the EasyOCR recognizer module backed by onnxruntime.
+    EasyOCR calls model(image, text) and post-processes a torch tensor, so we keep that contract.
+    """
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def forward(self, input, text=None):
+        logits = self.session.run(None, {self.input_name: input.cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+class OnnxEasyOCREngine(QuantizedEasyOCREngine):
+    """
+    EasyOCR detection + recognition through an ONNX-exported recognizer.
+    Requires onnxruntime and weights produced by export_onnx_recognizer().
+    """
+    name = "onnx"
+
+    def __init__(self, model_path: str):
+        import onnxruntime
+
+        super().__init__()
+        options = onnxruntime.SessionOptions()
+        threads = int(os.getenv("OCR_THREADS", "0"))
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.reader.recognizer = _OnnxRecognizer(session)
+
+
+def quantize_recognizer(reader):
+    """
+    Applies int8 dynamic quantization to the reader's recognizer unless it already is.
+    EasyOCR quantizes on CPU by default, but silently skips it if quantization fails.
+    """
+    model = reader.recognizer
+    already_quantized = any(
+        type(m).__module__.startswith("torch.ao.nn.quantized") for m in model.modules()
+    )
+    if already_quantized:
+        return model
+
+    try:
+        torch.quantization.quantize_dynamic(
+            model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+    except Exception as e:
+        print(f"Warning: recognizer quantization failed, staying in fp32: {e}")
+    return model
+
+
+def export_onnx_recognizer(output_path: str = DEFAULT_ONNX_MODEL):
+    """
+    Exports the fp32 EasyOCR recognizer to ONNX (dynamic batch and width).
+    Quantized modules can't be exported, so a non-quantized reader is loaded for this.
+    """
+    reader = easyocr.Reader(LANGUAGES, gpu=False, quantize=False, detector=False)
+    model = reader.recognizer
+    model.eval()
+
+    class _ImageOnly(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, image):
+            return self.inner(image, None)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    # EasyOCR feeds grey crops resized to a height of 64
+    dummy = torch.randn(1, 1, 64, 256)
+    torch.onnx.export(
+        _ImageOnly(model), (dummy,), output_path,
+        input_names=["image"], output_names=["logits"],
+        dynamic_axes={"image": {0: "batch", 3: "width"}, "logits": {0: "batch", 1: "steps"}},
+        opset_version=17,
+    )
+    return output_path
+
+
+def create_engine(name: str = None) -> OCREngine:
+    """
+    Builds the OCR backend selected by OCR_ENGINE (easyocr | quantized | onnx).
+    The onnx backend falls back to quantized when its weights or onnxruntime are missing.
+    """
+    name = (name or os.getenv("OCR_ENGINE", "easyocr")).lower()
+
+    if name == "onnx":
+        model_path = os.getenv("OCR_ONNX_MODEL", DEFAULT_ONNX_MODEL)
+        if not os.path.exists(model_path):
+            print(f"Warning: ONNX recognizer not found at {model_path}, using quantized engine")
+            return QuantizedEasyOCREngine()
+        try:
+            return OnnxEasyOCREngine(model_path)
+        except ImportError:
+            print("Warning: onnxruntime not installed, using quantized engine")
+            return QuantizedEasyOCREngine()
+
+    if name == "quantized":
+        return QuantizedEasyOCREngine()
+    if name != "easyocr":
+        print(f"Warning: unknown OCR_ENGINE '{name}', using easyocr")
+    return EasyOCREngine()
+
+
+def _to_grey(image):
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def _enhance_contrast(grey):
+    # CLAHE lifts faint pencil/photocopy strokes without blowing out the rest of the line
+    return cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(grey)
+
+
+def _recheck(engine, grey, results: list, indices: list[int], threshold: float) -> int:
+    """
+    Re-recognizes results[i] for i in indices on `grey` and keeps whichever reading is more
+    confident. Returns how many lines improved; indices still below threshold are left in place.
+    """
+    height, width = grey.shape[:2]
+    boxes = {}
+    for i in indices:
+        points = results[i][0]
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        # A little padding: boxes from the downscaled pass are a few pixels tight at native size
+        pad = max(2, int((max(ys) - min(ys)) * 0.1))
+        box = [
+            max(0, int(min(xs)) - pad), min(width, int(max(xs)) + pad),
+            max(0, int(min(ys)) - pad), min(height, int(max(ys)) + pad),
+        ]
+        boxes[(box[0], box[2])] = (i, box)
+
+    improved = 0
+    for box, text, confidence in engine.recognize(grey, [box for _, box in boxes.values()]):
+        # Results come back as corner points; match them to the requested box by top-left corner
+        key = (int(box[0][0]), int(box[0][1]))
+        if key not in boxes:
+            continue
+        i = boxes[key][0]
+        if confidence > results[i][2] and str(text).strip():
+            results[i] = (results[i][0], text, confidence)
+            improved += 1
+    indices[:] = [i for i in indices if results[i][2] < threshold]
+    return improved
+
+
+def read_page(engine, image, mode: str = None) -> list:
+    """
+    Page OCR with boxes and confidences (readtext detail=1), in reading order.
+
+    mode "adaptive" (OCR_MODE): detection and recognition run on a copy downscaled to
+    OCR_FAST_MAX_SIDE, then only lines below OCR_RECHECK_CONFIDENCE are recognized again on
+    the native-resolution page, and those still below it once more with CLAHE contrast
+    enhancement. Boxes are mapped back to native coordinates and each line keeps its most
+    confident reading, so the output is in the fast pass's reading order.
+    """
+    mode = (mode or os.getenv("OCR_MODE", "full")).lower()
+    if mode != "adaptive":
+        return engine.readtext(image, detail=1)
+
+    max_side = int(os.getenv("OCR_FAST_MAX_SIDE", FAST_MAX_SIDE))
+    threshold = float(os.getenv("OCR_RECHECK_CONFIDENCE", RECHECK_CONFIDENCE))
+
+    started = time.perf_counter()
+    scale = min(1.0, max_side / max(image.shape[:2]))
+    small = image if scale == 1.0 else cv2.resize(
+        image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+    )
+    results = [
+        ([[p[0] / scale, p[1] / scale] for p in box], text, float(confidence))
+        for box, text, confidence in engine.readtext(small, detail=1)
+    ]
+    fast_seconds = time.perf_counter() - started
+
+    low = [i for i, r in enumerate(results) if r[2] < threshold]
+    rechecked = len(low)
+    improved = 0
+    if low:
+        grey = _to_grey(image)
+        improved += _recheck(engine, grey, results, low, threshold)
+        if low:
+            improved += _recheck(engine, _enhance_contrast(grey), results, low, threshold)
+
+    print(f"Adaptive OCR: {len(results)} lines at {scale:.2f}x in {fast_seconds:.1f}s, "
+          f"{rechecked} re-read at native resolution ({improved} improved) "
+          f"in {time.perf_counter() - started - fast_seconds:.1f}s")
+    return results
+
+
+def _edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def character_error_rate(reference: str, hypothesis: str) -> float:
+    """
+    Levenshtein distance normalised by the reference length (whitespace ignored).
+    """
+    reference = "".join(reference.split())
+    hypothesis = "".join(hypothesis.split())
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    return _edit_distance(reference, hypothesis) / len(reference)
+
+
+def compare_engines(image_paths: list[str], engine_names: list[str], reference: str = "easyocr") -> dict:
+    """
+    Runs every engine over the same pages and reports latency and accuracy.
+
+    Accuracy is the character error rate against a ground-truth transcript next to the image
+    (page.jpg -> page.txt) when one exists, otherwise against the output of the reference engine.
+    """
+    import cv2
+    import numpy as np
+
+    images = {}
+    for path in image_paths:
+        img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"Could not read image at {path}")
+        images[path] = img
+
+    outputs = {}
+    report = {}
+    for name in [reference] + [n for n in engine_names if n != reference]:
+        engine = create_engine(name)
+        # Warm-up so model loading and first-call allocation don't count as page latency
+        engine.readtext(next(iter(images.values())), detail=0)
+
+        texts = {}
+        start = time.perf_counter()
+        for path, img in images.items():
+            texts[path] = "\n".join(engine.readtext(img, detail=0))
+        elapsed = time.perf_counter() - start
+
+        outputs[name] = texts
+        report[name] = {"engine": engine.name, "ms_per_page": elapsed * 1000 / len(images)}
+
+    for name, texts in outputs.items():
+        errors = []
+        for path, text in texts.items():
+            truth_path = os.path.splitext(path)[0] + ".txt"
+            if os.path.exists(truth_path):
+                with open(truth_path, encoding="utf-8") as f:
+                    truth = f.read()
+            else:
+                truth = outputs[reference][path]
+            errors.append(character_error_rate(truth, text))
+        report[name]["cer"] = sum(errors) / len(errors)
+        report[name]["speedup"] = report[reference]["ms_per_page"] / max(report[name]["ms_per_page"], 1e-9)
+
+    return report
+
+
+if __name__ == "__main__":
+    # python -m app.services.ocr page1.jpg page2.jpg --engines quantized onnx
+    parser = argparse.ArgumentParser(description="Compare OCR backends on speed and accuracy")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--engines", nargs="+", default=["easyocr", "quantized", "onnx"])
+    parser.add_argument("--reference", default="easyocr")
+    parser.add_argument("--export-onnx", metavar="PATH", help="Export the ONNX recognizer first")
+    args = parser.parse_args()
+
+    if args.export_onnx:
+        print(f"Exported recognizer to {export_onnx_recognizer(args.export_onnx)}")
+        os.environ["OCR_ONNX_MODEL"] = args.export_onnx
+
+    for name, row in compare_engines(args.images, args.engines, args.reference).items():
+        print(f"{name:10s} {row['engine']:10s} {row['ms_per_page']:9.1f} ms/page  "
+              f"CER {row['cer']:.4f}  x{row['speedup']:.2f}")
@@ -0,0 +1,374 @@
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+
+from .. import models
+from ..database import SessionLocal
+from . import vision, llm, routing, scheduler, singleflight, cancellation, solutions
+
+# In-memory stage counters per ingest batch (rows in the DB are the source of truth for the rest)
+_batches = {}
+_batches_lock = threading.Lock()
+# batch id -> when run_batch returned; its solves may still be running, so it is kept a while
+_batches_finished = {}
+BATCH_TTL_SECONDS = 3600
+MAX_TRACKED_BATCHES = 100
+# paper id -> process generation; a reprocess starts a new one instead of joining the current run
+_generations = {}
+_generations_lock = threading.Lock()
+
+
+def ocr_paper(paper_id: int) -> str:
+    """
+    Full-page OCR of a stored paper. Runs as a task in the OCR lane.
+    """
+    db = SessionLocal()
+    try:
+        paper = db.query(models.Paper).filter(models.Paper.id == paper_id).first()
+        if not paper:
+            raise CancelledError()
+        file_path = paper.file_path
+    finally:
+        db.close()
+
+    # Resolve absolute path to avoid cv2 issues with relative paths
+    abs_file_path = os.path.abspath(file_path)
+    print(f"Vision processing: {abs_file_path}")
+    page = vision.read_full_page(abs_file_path)
+    full_text = page.text if page is not None else ""
+    print(f"Full Text Extracted: {len(full_text)} chars")
+    if not full_text.strip():
+        # Unreadable image or nothing recognised; don't mark such a page processed
+        raise ValueError(f"No text recognised on paper {paper_id}")
+
+    # Keep the normalization saving on the paper so it can be checked per upload
+    db = SessionLocal()
+    try:
+        db.query(models.Paper).filter(models.Paper.id == paper_id).update(
+            {"ocr_tokens_before": page.tokens_before, "ocr_tokens_after": page.tokens_after},
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+    return full_text
+
+
+def process_paper(paper_id: int, user: str = None, reprocess: bool = False, on_ocr_done=None):
+    """
+    OCR -> streaming split for one paper. The single entry point for POST /process and ingest
+    batches: concurrent calls for a paper share one run, and a processed paper isn't redone.
+
+    Returns {"status", "questions_found"}, or None if the paper doesn't exist. Raises
+    CancelledError if the paper is deleted or re-processed meanwhile.
+    Holds the single-flight key while waiting on the lanes, so never call it from a lane task.
+
+    A reprocess supersedes the run in flight: that run is cancelled and the reprocess starts a
+    new generation, which later calls join instead.
+    """
+    with _generations_lock:
+        if reprocess:
+            # Stop the previous run's queued/in-flight work before starting over
+            cancellation.cancel(cancellation.paper_scope(paper_id))
+            _generations[paper_id] = _generations.get(paper_id, 0) + 1
+        generation = _generations.get(paper_id, 0)
+
+    try:
+        # Double-clicks, several open tabs and a running batch: OCR happens once and questions
+        # are only inserted once
+        return singleflight.do(
+            ("process", paper_id, generation), _process_paper, paper_id, user, reprocess, on_ocr_done
+        )
+    finally:
+        with _generations_lock:
+            if generation and _generations.get(paper_id) == generation:
+                # Nothing newer started: the next normal call is generation 0 again
+                del _generations[paper_id]
+
+
+def _process_paper(paper_id: int, user: str, reprocess: bool, on_ocr_done):
+    db = SessionLocal()
+    try:
+        paper = db.query(models.Paper).filter(models.Paper.id == paper_id).first()
+        if not paper:
+            return None
+
+        scope = cancellation.paper_scope(paper_id)
+        if reprocess:
+            # Start over with a clean slate (the previous run was cancelled by process_paper)
+            db.query(models.Question).filter(models.Question.paper_id == paper_id).delete(synchronize_session=False)
+            paper.is_processed = False
+            db.commit()
+            db.expire(paper, ["questions"])
+
+        if paper.is_processed:
+            # If already processed, maybe retry logic or just return existing
+            return {"status": "completed", "questions_found": len(paper.questions)}
+    finally:
+        db.close()
+
+    cancel_token = cancellation.token_for(scope)
+    try:
+        # 1. OCR in the OCR lane
+        full_text = scheduler.ocr.run(
+            ocr_paper, paper_id,
+            priority=scheduler.FRESH_UPLOAD, user=user, cancel_token=cancel_token
+        )
+        if on_ocr_done is not None:
+            on_ocr_done()
+
+        # 2. Streaming split in the LLM lane; each question is persisted and queued for
+        # solving as soon as the splitter emits it
+        questions_found = scheduler.llm.run(
+            split_and_queue, paper_id, full_text, user, cancel_token,
+            priority=scheduler.FRESH_UPLOAD, user=user, cancel_token=cancel_token
+        )
+        return {"status": "processing_started", "questions_found": questions_found}
+    finally:
+        # Queued solves hold the token themselves until they finish
+        cancellation.release(cancel_token)
+
+
+def split_and_queue(paper_id: int, full_text: str, user: str = None, cancel_token=None) -> int:
+    """
+    Splits the OCR text with the streaming splitter. Runs as a task in the LLM lane.
+
+    Each question is persisted and its solve queued in the LLM lane as soon as the splitter
+    finishes emitting it, so the first answer doesn't wait for the whole paper to be split.
+    Returns the number of questions created and marks the paper processed.
+    """
+    db = SessionLocal()
+    try:
+        paper = db.query(models.Paper).filter(models.Paper.id == paper_id).first()
+        if not paper:
+            raise CancelledError()
+
+        questions_found = 0
+        created = []
+        try:
+            for idx, q_text in enumerate(llm.stream_split_questions(full_text)):
+                # The paper may have been deleted while the splitter was running
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+
+                # Create Question object (Initially Unsolved)
+                q = models.Question(
+                    paper_id=paper.id,
+                    image_path=paper.file_path,
+                    bbox_json="[]",
+                    ocr_text=q_text,
+                    solution_text="", # Empty initially
+                    order_index=idx + 1
+                )
+                db.add(q)
+                db.commit()
+                created.append(q.id)
+                questions_found += 1
+
+                # Queue its solve right away instead of waiting for the rest of the paper
+                if cancel_token is not None:
+                    cancellation.retain(cancel_token)
+                scheduler.llm.submit(
+                    solve_question_in_background, q.id, user, cancel_token,
+                    priority=scheduler.FRESH_UPLOAD, user=user, cancel_token=cancel_token
+                )
+        except Exception:
+            # Split broke part-way: leave the paper unprocessed and without a partial question
+            # set, so processing it again starts clean (queued solves find nothing to do)
+            db.rollback()
+            if created:
+                db.query(models.Question).filter(models.Question.id.in_(created)).delete(synchronize_session=False)
+                db.commit()
+            raise
+
+        print(f"LLM Split into {questions_found} questions")
+
+        paper.is_processed = True
+        db.commit()
+        return questions_found
+    finally:
+        db.close()
+
+
+def solve_text(question_text: str) -> dict:
+    """
+    Routed solve of one question text, shared with any identical solve already in flight.
+
+    Only call this from inside an LLM-lane task. The single-flight key must never be held while
+    waiting for a lane worker: a follower parked on a worker would wait forever for a leader
+    that is still queued behind it.
+    """
+    return singleflight.do(
+        ("solve", singleflight.content_key(question_text)),
+        routing.solve_question, question_text
+    )
+
+
+def solve_question_in_background(qid: int, user: str = None, cancel_token=None):
+    """
+    Formats and solves one question. Runs as a task in the LLM lane (submit it with
+    scheduler.llm.submit), so the LLM is called directly here rather than through the lane.
+    """
+    db = SessionLocal()
+    try:
+        q = db.query(models.Question).filter(models.Question.id == qid).first()
+        if q and q.ocr_text:
+            # 1. Format and Check Integrity
+            print(f"Formatting Q{qid}...")
+            fmt_result = singleflight.do(
+                ("format", singleflight.content_key(q.ocr_text)),
+                llm.format_and_check_question, q.ocr_text
+            )
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+
+            q.ocr_text = fmt_result.get("formatted_text", q.ocr_text)
+            q.is_incomplete = not fmt_result.get("is_complete", True)
+            db.commit() # Save formatted text first
+
+            # 2. Solve if complete
+            if not q.is_incomplete:
+                print(f"Solving Q{qid}...")
+                # Routed to a model tier by difficulty; the result is a dict
+                sol_result = solve_text(q.ocr_text)
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+
+                # Versioned, so a later prompt/model change can find and re-solve it.
+                # A failed solve isn't recorded and the question stays stale for the backfill.
+                if solutions.record_solution(db, q, sol_result) is None:
+                    print(f"Solving Q{qid} failed: {sol_result.get('analysis')}")
+                    _mark_solve_failed(q)
+            else:
+                # Frontend reads the 'is_incomplete' flag instead of waiting for a solution
+                print(f"Q{qid} marked incomplete")
+
+            db.commit()
+    except CancelledError:
+        # Paper deleted or re-processed while we were waiting on the LLM: drop the result
+        print(f"Background solving cancelled at Q{qid}")
+        db.rollback()
+    except Exception as e:
+        print(f"Error solving question {qid}: {str(e)}")
+        db.rollback()
+        q = db.query(models.Question).filter(models.Question.id == qid).first()
+        if q is not None:
+            _mark_solve_failed(q)
+    finally:
+        db.close()
+        cancellation.release(cancel_token)
+
+
+def _mark(batch_id: str, stage: str, item_id: int):
+    with _batches_lock:
+        if batch_id in _batches:
+            _batches[batch_id][stage].add(item_id)
+
+
+def _mark_solve_failed(q):
+    # Lets batch progress count the question as settled; a later successful solve overrides it
+    if q.paper is not None and q.paper.batch_id:
+        _mark(q.paper.batch_id, "solve_failed", q.id)
+
+
+def _prune_batches():
+    """
+    Forgets batches that finished more than BATCH_TTL_SECONDS ago, and the longest finished
+    ones beyond MAX_TRACKED_BATCHES. Running batches are always kept. Caller holds _batches_lock.
+    """
+    now = time.monotonic()
+    expired = [b for b, finished_at in _batches_finished.items() if now - finished_at > BATCH_TTL_SECONDS]
+    overflow = len(_batches) - len(expired) - MAX_TRACKED_BATCHES
+    if overflow > 0:
+        remaining = sorted((b for b in _batches_finished if b not in expired), key=_batches_finished.get)
+        expired += remaining[:overflow]
+    for batch_id in expired:
+        _batches.pop(batch_id, None)
+        _batches_finished.pop(batch_id, None)
+
+
+def run_batch(batch_id: str, paper_ids: list[int], user: str = None):
+    """
+    Pipelined OCR -> split -> solve for a batch of papers.
+
+    Each page goes through process_paper, like POST /process, so a page that is also processed
+    by hand meanwhile is still OCR'd and split only once. Pages are started together and wait
+    in the OCR lane; as each OCR finishes its split is queued in the LLM lane. The two lanes run
+    concurrently, so the next page is being OCR'd while the LLM works on the previous ones and
+    throughput is bounded by the OCR pool.
+    """
+    with _batches_lock:
+        _prune_batches()
+        # Page ids per stage, and ids of questions whose solve failed
+        _batches[batch_id] = {"ocr_done": set(), "split_done": set(), "failed": set(), "solve_failed": set()}
+        _batches_finished.pop(batch_id, None)
+
+    def process(paper_id):
+        return process_paper(paper_id, user, on_ocr_done=lambda: _mark(batch_id, "ocr_done", paper_id))
+
+    # Enough pages waiting to keep both lanes busy; the lanes bound the actual work
+    workers = min(len(paper_ids), 2 * (scheduler.ocr.workers + scheduler.llm.workers)) or 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"ingest-{batch_id}") as pool:
+        futures = {pool.submit(process, paper_id): paper_id for paper_id in paper_ids}
+        for future in as_completed(futures):
+            paper_id = futures[future]
+            try:
+                result = future.result()
+            except CancelledError:
+                continue
+            except Exception as e:
+                print(f"Error processing paper {paper_id}: {e}")
+                _mark(batch_id, "failed", paper_id)
+                continue
+            if result is not None:
+                # Also covers pages someone else's run (or an earlier one) already finished
+                _mark(batch_id, "ocr_done", paper_id)
+                _mark(batch_id, "split_done", paper_id)
+
+    with _batches_lock:
+        if batch_id in _batches:
+            _batches_finished[batch_id] = time.monotonic()
+        _prune_batches()
+
+
+def batch_progress(db, batch_id: str) -> dict:
+    """
+    Aggregate progress of an ingest batch, or None if the batch is unknown.
+    """
+    papers = db.query(models.Paper.id, models.Paper.is_processed).filter(
+        models.Paper.batch_id == batch_id
+    ).all()
+    if not papers:
+        return None
+
+    paper_ids = [p.id for p in papers]
+    questions = db.query(
+        models.Question.id, models.Question.answer, models.Question.is_incomplete
+    ).filter(models.Question.paper_id.in_(paper_ids)).all()
+
+    with _batches_lock:
+        tracked = _batches.get(batch_id, {})
+        stages = {stage: len(ids) for stage, ids in tracked.items()}
+        solve_failed_ids = set(tracked.get("solve_failed", ()))
+
+    finished = sum(1 for q in questions if q.answer or q.is_incomplete)
+    # Only questions still without an answer: a failed solve retried successfully is solved
+    solve_failed = sum(
+        1 for q in questions if not (q.answer or q.is_incomplete) and q.id in solve_failed_ids
+    )
+    processed = sum(1 for p in papers if p.is_processed)
+
+    return {
+        "batch_id": batch_id,
+        "papers": len(papers),
+        "ocr_done": stages.get("ocr_done", 0),
+        "papers_processed": processed,
+        "failed": stages.get("failed", 0),
+        "questions": len(questions),
+        "questions_solved": finished,
+        "questions_failed": solve_failed,
+        # Failed pages and failed solves won't progress any further, so they count as settled
+        "done": processed + stages.get("failed", 0) >= len(papers)
+                and finished + solve_failed == len(questions),
+    }
@@ -0,0 +1,122 @@
+import os
+import re
+from dataclasses import dataclass
+
+from . import llm
+
+# Option markers at the start of a line or after whitespace: "A." "B、" "C:" "D)"
+OPTION_RE = re.compile(r'(?:^|\s)\(?([A-D])[\.．、:：\)]', re.MULTILINE)
+# Formula-ish content: LaTeX, operators, common math symbols
+MATH_RE = re.compile(r'\\[a-zA-Z]+|\$|[=<>≤≥≠±×÷√∫∑∏πθα-ω^]|\d+\s*[+\-*/]\s*\d+')
+# Sub-questions: (1) (2), ① ②, （1）（2）
+PART_RE = re.compile(r'[\(（]\s*\d\s*[\)）]|[①②③④⑤⑥]')
+PROOF_RE = re.compile(r'证明|求证|prove|show that', re.IGNORECASE)
+
+SHORT_QUESTION_CHARS = 300
+LONG_QUESTION_CHARS = 600
+HEAVY_MATH_TOKENS = 12
+
+
+@dataclass
+class QuestionProfile:
+    kind: str          # "choice" | "proof" | "open"
+    length: int
+    has_options: bool
+    has_math: bool
+    math_tokens: int
+    parts: int
+    difficulty: str    # "easy" | "hard"
+
+
+def classify_question(text: str) -> QuestionProfile:
+    """
+    Cheap local classification used to pick a model tier; no LLM call involved.
+    """
+    text = text or ""
+    options = set(OPTION_RE.findall(text))
+    has_options = len(options) >= 3
+    math_tokens = len(MATH_RE.findall(text))
+    parts = len(PART_RE.findall(text))
+    is_proof = bool(PROOF_RE.search(text))
+
+    if is_proof:
+        kind = "proof"
+    elif has_options:
+        kind = "choice"
+    else:
+        kind = "open"
+
+    hard = (
+        is_proof
+        or parts >= 2
+        or len(text) > LONG_QUESTION_CHARS
+        or (kind == "open" and math_tokens >= HEAVY_MATH_TOKENS)
+    )
+    easy = not hard and (kind == "choice" or len(text) <= SHORT_QUESTION_CHARS)
+
+    return QuestionProfile(
+        kind=kind,
+        length=len(text),
+        has_options=has_options,
+        has_math=math_tokens > 0,
+        math_tokens=math_tokens,
+        parts=parts,
+        difficulty="easy" if easy else "hard",
+    )
+
+
+def model_tiers() -> dict:
+    """
+    Configured tiers. Without LLM_FAST_MODEL every question goes to LLM_MODEL as before.
+    """
+    return {
+        "fast": os.getenv("LLM_FAST_MODEL") or None,
+        "strong": os.getenv("LLM_MODEL", "deepseek-ai/DeepSeek-V3"),
+    }
+
+
+def batch_model() -> str:
+    """
+    Model used for offline batch requests (services/batch). Defaults to LLM_MODEL.
+    """
+    return os.getenv("LLM_BATCH_MODEL") or os.getenv("LLM_MODEL", "deepseek-ai/DeepSeek-V3")
+
+
+def validate_solution(solution: dict, profile: QuestionProfile) -> bool:
+    """
+    Whether a fast-tier answer is good enough to keep, or the question must be escalated.
+    """
+    answer = solution.get("answer", "").strip()
+    analysis = solution.get("analysis", "").strip()
+    if not answer or not analysis:
+        return False
+    if analysis.startswith("Error"):
+        return False
+    if profile.kind == "choice":
+        # "C", "AC", "C. 42" are fine; a free-text answer to a choice question is not
+        return re.match(r'^\(?[A-D]{1,4}\b', answer.upper()) is not None
+    return True
+
+
+def solve_question(question_text: str) -> dict:
+    """
+    Solves with the cheapest tier that is good enough.
+
+    Easy questions go to LLM_FAST_MODEL first; its answer is validated locally and the question
+    is escalated to the strong model only when validation fails. Hard questions (proofs,
+    multi-part, long or math-heavy) go straight to the strong model.
+    """
+    profile = classify_question(question_text)
+    tiers = model_tiers()
+
+    if tiers["fast"] and profile.difficulty == "easy":
+        solution = llm.solve_question(question_text, model=tiers["fast"])
+        if validate_solution(solution, profile):
+            return {**solution, "model": tiers["fast"], "escalated": False}
+        print(f"Fast model answer failed validation ({profile.kind}), escalating")
+        escalated = True
+    else:
+        escalated = False
+
+    solution = llm.solve_question(question_text, model=tiers["strong"])
+    return {**solution, "model": tiers["strong"], "escalated": escalated}
@@ -0,0 +1,145 @@
+import os
+import time
+import itertools
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+
+# Priority classes (lower runs first)
+INTERACTIVE = 0   # a user is waiting on the response (e.g. "re-solve")
+FRESH_UPLOAD = 1  # background work for a paper that was just uploaded
+BACKFILL = 2      # bulk re-solves, nobody is waiting
+
+# A background task is promoted by one class for every AGING_SECONDS it waits, so backfill can't
+# starve. Aging stops at FRESH_UPLOAD: nothing ever catches up with a user waiting on a response.
+AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", "60"))
+
+
+class _Task:
+    __slots__ = ("future", "fn", "args", "kwargs", "priority", "user", "enqueued_at", "seq")
+
+    def __init__(self, fn, args, kwargs, priority, user, seq):
+        self.future = Future()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.user = user
+        self.enqueued_at = time.monotonic()
+        self.seq = seq
+
+
+class PriorityScheduler:
+    """
+    Bounded worker pool that always runs the most urgent queued task next.
+
+    Ordering key, evaluated when a worker frees up:
+      1. priority class, promoted by one class per `aging_seconds` of waiting (never past
+         FRESH_UPLOAD, so INTERACTIVE tasks always go first)
+      2. the user who was served least recently (round-robin between users in a class)
+      3. submission order
+    """
+
+    def __init__(self, name: str, workers: int, aging_seconds: float = AGING_SECONDS):
+        self.name = name
+        self.workers = max(1, workers)
+        self.aging_seconds = aging_seconds
+
+        self._queue = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._dispatch = itertools.count(1)
+        self._last_served = defaultdict(int)
+        self._running = defaultdict(int)  # priority class -> running tasks
+        self._threads = []
+
+    def submit(self, fn, *args, priority: int = FRESH_UPLOAD, user: str = None,
+               cancel_token=None, **kwargs) -> Future:
+        task = _Task(fn, args, kwargs, priority, user or "anonymous", next(self._seq))
+        if cancel_token is not None:
+            # Cancelling the token drops the task if it hasn't started yet
+            cancel_token.track(task.future)
+        with self._cond:
+            self._ensure_workers()
+            self._queue.append(task)
+            self._cond.notify()
+        return task.future
+
+    def run(self, fn, *args, priority: int = FRESH_UPLOAD, user: str = None,
+            cancel_token=None, **kwargs):
+        """
+        Submits and blocks until the task has run, returning its result (or raising its error).
+        Raises concurrent.futures.CancelledError if the token was cancelled before it started.
+        """
+        future = self.submit(fn, *args, priority=priority, user=user, cancel_token=cancel_token, **kwargs)
+        return future.result()
+
+    def pending(self, max_priority: int = None) -> int:
+        """
+        Number of queued + running tasks, optionally only those at or above a priority class.
+        """
+        with self._cond:
+            queued = [t for t in self._queue if not t.future.cancelled()]
+            running = self._running.items()
+            if max_priority is not None:
+                queued = [t for t in queued if t.priority <= max_priority]
+                running = [(p, n) for p, n in running if p <= max_priority]
+            return len(queued) + sum(n for _, n in running)
+
+    def _effective_priority(self, task: _Task, now: float) -> int:
+        if self.aging_seconds <= 0 or task.priority <= FRESH_UPLOAD:
+            return task.priority
+        waited = now - task.enqueued_at
+        return max(FRESH_UPLOAD, task.priority - int(waited // self.aging_seconds))
+
+    def _pop_next(self) -> _Task:
+        now = time.monotonic()
+        task = min(
+            self._queue,
+            key=lambda t: (self._effective_priority(t, now), self._last_served[t.user], t.seq),
+        )
+        self._queue.remove(task)
+        self._last_served[task.user] = next(self._dispatch)
+        return task
+
+    def _ensure_workers(self):
+        # Workers are started lazily so importing the module doesn't spawn threads
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._worker, name=f"{self.name}-worker-{len(self._threads)}", daemon=True
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                task = self._pop_next()
+                self._running[task.priority] += 1
+
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    try:
+                        task.future.set_result(task.fn(*task.args, **task.kwargs))
+                    except BaseException as e:
+                        task.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[task.priority] -= 1
+
+
+# Shared lanes: every LLM request and every OCR pass goes through one of these
+llm = PriorityScheduler("llm", workers=int(os.getenv("LLM_CONCURRENCY", "4")))
+ocr = PriorityScheduler("ocr", workers=int(os.getenv("OCR_CONCURRENCY", "1")))
+
+
+def user_from_request(request) -> str:
+    """
+    Fairness key for a request: explicit X-User-Id header, else the client address.
+    """
+    user = request.headers.get("X-User-Id")
+    if user:
+        return user
+    return request.client.host if request.client else "anonymous"
@@ -0,0 +1,172 @@
+import re
+import html
+from sqlalchemy import DDL, event, inspect, text
+
+from .. import models
+from ..database import Base
+
+# FTS5 index over the question library, keyed by question id (rowid).
+# unicode61 would index a run of Chinese as one huge token, so text is segmented here first:
+# CJK runs become overlapping bigrams, everything else lowercase words, joined by spaces.
+FTS_TABLE = "question_fts"
+
+# bm25 weights for (text, answer, analysis): a hit in the question itself ranks highest
+BM25_WEIGHTS = (10.0, 2.0, 1.0)
+
+SNIPPET_CHARS = 80
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[^\W{_CJK}_]+")
+_IS_CJK = re.compile(rf"[{_CJK}]")
+
+event.listen(Base.metadata, "after_create", DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(text, answer, analysis, tokenize='unicode61')"
+))
+# Papers cascade to questions inside SQLite, where no ORM event sees the delete
+event.listen(Base.metadata, "after_create", DDL(
+    f"CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions "
+    f"BEGIN DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END"
+))
+event.listen(Base.metadata, "before_drop", DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+
+
+def segment(value: str, query: bool = False) -> list[str]:
+    """
+    Index terms for a text: bigrams for Chinese runs plus the run's last character
+    (so single-character queries can prefix-match), lowercase words for the rest.
+    Queries only need the trailing character when the run is a single character.
+    """
+    terms = []
+    for token in _TOKEN_RE.findall(value or ""):
+        if _IS_CJK.match(token):
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+            if not query or len(token) == 1:
+                terms.append(token[-1])
+        else:
+            terms.append(token.lower())
+    return terms
+
+
+def _document(question) -> tuple[str, str, str]:
+    return tuple(
+        " ".join(segment(value))
+        for value in (question.ocr_text, question.answer, question.analysis)
+    )
+
+
+def _upsert(connection, question_id: int, document: tuple):
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": question_id})
+    connection.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, text, answer, analysis) VALUES (:id, :text, :answer, :analysis)"),
+        {"id": question_id, "text": document[0], "answer": document[1], "analysis": document[2]},
+    )
+
+
+@event.listens_for(models.Question, "after_insert")
+def _index_new_question(mapper, connection, target):
+    _upsert(connection, target.id, _document(target))
+
+
+@event.listens_for(models.Question, "after_update")
+def _reindex_question(mapper, connection, target):
+    # Runs in the same flush/transaction as the change; only re-segment when searchable text moved
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ("ocr_text", "answer", "analysis")):
+        _upsert(connection, target.id, _document(target))
+
+
+def ensure_index(bind):
+    """
+    Fills the index for rows written before it existed (or by a process without these hooks).
+    """
+    with bind.connect() as conn:
+        indexed = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+        total = conn.execute(text("SELECT count(*) FROM questions")).scalar()
+    if indexed != total:
+        rebuild(bind)
+
+
+def rebuild(bind):
+    print("Rebuilding question search index")
+    with bind.begin() as conn:
+        conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+        rows = conn.execute(text("SELECT id, ocr_text, answer, analysis FROM questions"))
+        for question_id, *values in rows.fetchall():
+            _upsert(conn, question_id, tuple(" ".join(segment(v)) for v in values))
+
+
+def match_expression(query: str) -> str:
+    """
+    FTS5 MATCH string for a user query: every term must appear (implicit AND).
+    Terms are quoted so user input can't inject FTS syntax.
+    """
+    parts = []
+    for term in dict.fromkeys(segment(query, query=True)):
+        quoted = '"' + term.replace('"', '""') + '"'
+        # A lone Chinese character is indexed as the first half of bigrams
+        parts.append(quoted + "*" if len(term) == 1 and _IS_CJK.match(term) else quoted)
+    return " ".join(parts)
+
+
+def snippet(value: str, query: str, width: int = SNIPPET_CHARS) -> str:
+    """
+    HTML-escaped excerpt around the first hit, with matched spans wrapped in <mark>.
+    """
+    value = value or ""
+    lowered = value.lower()
+    covered = [False] * len(value)
+    for term in set(segment(query, query=True)):
+        start = lowered.find(term)
+        while start != -1:
+            for i in range(start, start + len(term)):
+                covered[i] = True
+            start = lowered.find(term, start + 1)
+
+    first = covered.index(True) if True in covered else 0
+    begin = max(0, first - width // 4)
+    end = min(len(value), begin + width)
+
+    parts = ["…" if begin > 0 else ""]
+    i = begin
+    while i < end:
+        j = i
+        while j < end and covered[j] == covered[i]:
+            j += 1
+        chunk = html.escape(value[i:j])
+        parts.append(f"<mark>{chunk}</mark>" if covered[i] else chunk)
+        i = j
+    parts.append("…" if end < len(value) else "")
+    return "".join(parts)
+
+
+def search(db, query: str, limit: int = 20, offset: int = 0, paper_id: int = None):
+    """
+    Ranked question ids for a query. Returns (total hits, [(question, score)]).
+    """
+    expression = match_expression(query)
+    if not expression:
+        return 0, []
+
+    paper_filter = ""
+    params = {"match": expression, "limit": limit, "offset": offset}
+    if paper_id is not None:
+        paper_filter = "AND rowid IN (SELECT id FROM questions WHERE paper_id = :paper_id)"
+        params["paper_id"] = paper_id
+
+    total = db.execute(
+        text(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match {paper_filter}"), params
+    ).scalar()
+    weights = ", ".join(map(str, BM25_WEIGHTS))
+    hits = db.execute(
+        text(
+            f"SELECT rowid, bm25({FTS_TABLE}, {weights}) AS rank FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH :match {paper_filter} ORDER BY rank LIMIT :limit OFFSET :offset"
+        ),
+        params,
+    ).fetchall()
+
+    questions = {
+        q.id: q for q in db.query(models.Question).filter(models.Question.id.in_([h[0] for h in hits]))
+    }
+    # bm25 is lower-is-better; flip it so clients can treat score as relevance
+    return total, [(questions[h[0]], -h[1]) for h in hits if h[0] in questions]
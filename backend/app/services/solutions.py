@@ -0,0 +1,100 @@
+from sqlalchemy import and_, or_
+
+from .. import models
+from ..prompts import SOLVER_PROMPT_VERSION
+from . import routing, singleflight
+
+
+def input_hash(question_text: str) -> str:
+    return singleflight.content_key(question_text or "")
+
+
+def current_models() -> set:
+    """
+    Models whose answers are considered up to date: every configured routing tier and the
+    batch model, so batch results aren't re-solved as soon as they are written back.
+    """
+    return {model for model in routing.model_tiers().values() if model} | {routing.batch_model()}
+
+
+def is_failed(result: dict) -> bool:
+    """
+    Whether a solver result is an error report rather than a solution.
+    """
+    return bool(result.get("error")) or not (
+        str(result.get("answer") or "").strip() or str(result.get("analysis") or "").strip()
+    )
+
+
+def record_solution(db, question, result: dict, prompt_version: str = None):
+    """
+    Stores a new solution version and makes it the question's current answer.
+    `prompt_version` defaults to the current one (batch results may come from an older prompt).
+    A failed result (see is_failed) is not recorded: the question keeps its previous answer and
+    stays stale, so it is retried later. Returns the new Solution, or None. The caller commits.
+    """
+    if is_failed(result):
+        return None
+
+    db.query(models.Solution).filter(
+        models.Solution.question_id == question.id,
+        models.Solution.is_current == True  # noqa: E712
+    ).update({"is_current": False}, synchronize_session=False)
+
+    solution = models.Solution(
+        question_id=question.id,
+        model=result.get("model", ""),
+        prompt_version=prompt_version or SOLVER_PROMPT_VERSION,
+        input_hash=input_hash(question.ocr_text),
+        answer=result.get("answer", ""),
+        analysis=result.get("analysis", ""),
+        is_current=True,
+    )
+    db.add(solution)
+
+    question.answer = solution.answer
+    question.analysis = solution.analysis
+    # Backward compatibility / flag for frontend checking
+    question.solution_text = question.analysis
+    return solution
+
+
+def is_stale(question, current) -> bool:
+    """
+    A question needs re-solving if it has no recorded solution, or the current one came from
+    another prompt version, a model that is no longer configured, or different question text.
+    """
+    if current is None:
+        return True
+    return (
+        current.prompt_version != SOLVER_PROMPT_VERSION
+        or current.model not in current_models()
+        or current.input_hash != input_hash(question.ocr_text)
+    )
+
+
+def scan_stale(db, after_id: int = 0, limit: int = 50):
+    """
+    Scans the next `limit` solvable questions after `after_id` (in id order).
+    Returns (stale questions, skipped up-to-date count, last scanned id or None when done).
+    """
+    rows = (
+        db.query(models.Question, models.Solution)
+        .outerjoin(models.Solution, and_(
+            models.Solution.question_id == models.Question.id,
+            models.Solution.is_current == True  # noqa: E712
+        ))
+        .filter(
+            models.Question.id > after_id,
+            models.Question.ocr_text != "",
+            or_(models.Question.is_incomplete == False, models.Question.is_incomplete.is_(None)),  # noqa: E712
+        )
+        .order_by(models.Question.id)
+        .limit(limit)
+        .all()
+    )
+    if not rows:
+        return [], 0, None
+
+    stale = [question for question, current in rows if is_stale(question, current)]
+    return stale, len(rows) - len(stale), rows[-1][0].id
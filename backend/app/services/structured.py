@@ -0,0 +1,281 @@
+import os
+import re
+import json
+import threading
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+
+# Shared parsing for every LLM call that is supposed to return JSON.
+# Output we already paid for is extracted and repaired locally first; the model is asked
+# again only when that fails (see generate()).
+
+_json_mode_unsupported = set()
+_lock = threading.Lock()
+
+# LaTeX commands whose first letter collides with a JSON escape (\b \f \n \r \t), so an unescaped
+# "\frac" still parses, as a form feed followed by "rac".
+LATEX_COMMANDS = {
+    "b": {"beta", "bar", "begin", "binom", "big", "bigg", "bmod", "boxed", "bot", "bullet", "because",
+          "backslash", "bigcup", "bigcap", "bf"},
+    "f": {"frac", "forall", "flat", "frown"},
+    "n": {"neq", "ne", "nabla", "not", "nu", "neg", "newline", "nmid", "notin", "nexists", "ngeq",
+          "nleq", "nparallel", "nsubseteq"},
+    "r": {"rho", "right", "rightarrow", "rangle", "rfloor", "rceil", "rm"},
+    "t": {"theta", "tau", "tan", "times", "text", "textbf", "textrm", "to", "top", "triangle",
+          "tfrac", "therefore", "tilde", "tiny", "triangleq"},
+}
+_ESCAPE_LETTERS = {"\b": "b", "\f": "f", "\n": "n", "\r": "r", "\t": "t"}
+_COLLIDED_ESCAPE = re.compile(r"([\b\f\n\r\t])([A-Za-z]+)")
+# \b and \f never belong in question text, so before parsing they are read as LaTeX when a known
+# command follows; \\ is matched first so an already escaped backslash is left alone
+_RAW_LATEX_ESCAPE = re.compile(r"\\\\|\\([bf])([A-Za-z]+)")
+# A backslash that does not start a valid JSON escape (\alpha, \sqrt, \( ...)
+_INVALID_ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{4}|["\\/bfnrt])|\\')
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+
+
+class StructuredOutputError(ValueError):
+    """
+    The response could not be turned into the expected schema. `raw` is the last response text.
+    """
+
+    def __init__(self, message: str, raw: str = ""):
+        super().__init__(message)
+        self.raw = raw
+
+
+class SolutionOutput(BaseModel):
+    answer: str = ""
+    analysis: str = ""
+
+    @field_validator("answer", "analysis", mode="before")
+    @classmethod
+    def _stringify(cls, value):
+        # Models return "answer": 42 or "answer": null often enough
+        return "" if value is None else str(value)
+
+    @model_validator(mode="after")
+    def _not_empty(self):
+        if not self.answer.strip() and not self.analysis.strip():
+            raise ValueError("answer and analysis are both empty")
+        return self
+
+
+class SplitOutput(BaseModel):
+    questions: list[str] = Field(min_length=1)
+
+    @model_validator(mode="before")
+    @classmethod
+    def _accept_bare_list(cls, value):
+        return {"questions": value} if isinstance(value, list) else value
+
+    @field_validator("questions", mode="before")
+    @classmethod
+    def _unwrap_items(cls, items):
+        if not isinstance(items, list):
+            return items
+        unwrapped = []
+        for item in items:
+            if isinstance(item, dict):
+                # Some models wrap items: {"question": "..."} / {"text": "..."}
+                item = item.get("question") or item.get("text") or ""
+            item = str(item).strip()
+            if item:
+                unwrapped.append(item)
+        return unwrapped
+
+
+class FormatOutput(BaseModel):
+    formatted_text: str = Field(min_length=1)
+    is_complete: bool = True
+
+
+def extract_json(text: str) -> str:
+    """
+    The JSON value inside a response: code fences, leading prose and trailing text are dropped.
+    An unterminated value (truncated output) is returned up to the end of the text.
+    """
+    text = str(text or "").strip()
+    fenced = _FENCE.search(text)
+    if fenced and fenced.group(1).strip():
+        text = fenced.group(1).strip()
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise StructuredOutputError("no JSON object or array in response", text)
+    start = min(starts)
+
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def repair_json(candidate: str) -> str:
+    """
+    Local fixes for the usual ways model JSON is broken: LaTeX backslashes that aren't valid
+    escapes, trailing commas, and output cut off mid-string or before the closing brackets.
+    """
+    candidate = _INVALID_ESCAPE.sub(lambda m: m.group(0) if m.group(1) else "\\\\", candidate)
+
+    out, stack = [], []
+    in_string, escaped = False, False
+    for ch in candidate:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            # Trailing comma before a closer
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(ch)
+
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+    while out and (out[-1].isspace() or out[-1] == ","):
+        out.pop()
+    if out and out[-1] == ":":
+        out.append("null")
+    out.extend(reversed(stack))
+    return "".join(out)
+
+
+def escape_latex(candidate: str) -> str:
+    """
+    Doubles the backslash of \\b / \\f escapes that are really LaTeX commands ("\\frac", "\\beta").
+    """
+    def escape(match):
+        if match.group(1) is None or match.group(1) + match.group(2) not in LATEX_COMMANDS[match.group(1)]:
+            return match.group(0)
+        return "\\" + match.group(0)
+
+    return _RAW_LATEX_ESCAPE.sub(escape, candidate)
+
+
+def has_invalid_escapes(candidate: str) -> bool:
+    return any(not m.group(1) for m in _INVALID_ESCAPE.finditer(candidate))
+
+
+def restore_latex(value):
+    """
+    Undoes JSON escapes that were really LaTeX commands ("\\x0crac" -> "\\frac").
+    Only safe when the output is known to contain unescaped LaTeX: in well-formed JSON,
+    "\\n" + "u = 3" is a newline, not \\nu.
+    """
+    if isinstance(value, dict):
+        return {k: restore_latex(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [restore_latex(v) for v in value]
+    if not isinstance(value, str):
+        return value
+
+    def restore(match):
+        letter = _ESCAPE_LETTERS[match.group(1)]
+        command = letter + match.group(2)
+        return "\\" + command if command in LATEX_COMMANDS[letter] else match.group(0)
+
+    return _COLLIDED_ESCAPE.sub(restore, value)
+
+
+def loads(candidate: str):
+    """
+    json.loads that falls back to repair_json.
+
+    Valid JSON is taken as written (apart from \\b / \\f LaTeX, see escape_latex). Newline and tab
+    escapes are only read back as LaTeX when the output also had backslashes that aren't valid
+    escapes, i.e. the model wrote its LaTeX unescaped.
+    """
+    candidate = escape_latex(candidate)
+    try:
+        return json.loads(candidate, strict=False)
+    except ValueError:
+        try:
+            value = json.loads(repair_json(candidate), strict=False)
+        except ValueError as e:
+            raise StructuredOutputError(f"invalid JSON: {e}", candidate)
+    return restore_latex(value) if has_invalid_escapes(candidate) else value
+
+
+def parse(raw: str, schema: type[BaseModel]) -> BaseModel:
+    """
+    Response text -> validated schema instance, or StructuredOutputError.
+    """
+    try:
+        return schema.model_validate(loads(extract_json(raw)))
+    except StructuredOutputError as e:
+        e.raw = raw
+        raise
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'value'}: {err['msg']}" for err in e.errors())
+        raise StructuredOutputError(f"schema mismatch: {errors}", raw)
+
+
+def generate(run, schema: type[BaseModel]) -> BaseModel:
+    """
+    run(feedback) performs one LLM call and returns its text; feedback is None the first time,
+    then (previous output, parse error) for the single corrective retry made when local
+    extraction and repair both fail.
+    """
+    raw = run(None)
+    try:
+        return parse(raw, schema)
+    except StructuredOutputError as e:
+        print(f"Structured output unusable ({e}), retrying once")
+        return parse(run((raw, str(e))), schema)
+
+
+def _json_mode() -> str:
+    # auto: ask for JSON mode and switch it off per model if the provider rejects it; 1: always; 0: never
+    return os.getenv("LLM_JSON_MODE", "auto").lower()
+
+
+def json_mode_enabled(model: str) -> bool:
+    mode = _json_mode()
+    if mode in ("0", "false", "off"):
+        return False
+    if mode in ("1", "true", "on"):
+        return True
+    with _lock:
+        return model not in _json_mode_unsupported
+
+
+def disable_json_mode(model: str):
+    with _lock:
+        _json_mode_unsupported.add(model)
+
+
+def is_json_mode_error(error: Exception) -> bool:
+    """
+    Whether a provider error means response_format isn't supported (as opposed to any other failure).
+    """
+    return _json_mode() == "auto" and "response_format" in str(error)
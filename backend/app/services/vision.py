@@ -1,10 +1,12 @@
 import cv2
 import numpy as np
 import os
-import easyocr
-import uuid
 import json
 import subprocess
+from . import ocr, normalize
+
+# Set to 0 to send raw OCR lines to the LLM (e.g. to compare against normalized output)
+NORMALIZE_OCR = os.getenv("OCR_NORMALIZE", "1") != "0"
 
 # Global reader instance (initialize once to avoid reloading model)
 _reader = None
@@ -12,17 +14,17 @@ _reader = None
 def get_reader():
     global _reader
     if _reader is None:
-        # gpu=False assumes no CUDA; change to True if user has NVIDIA GPU
-        _reader = easyocr.Reader(['ch_sim', 'en'], gpu=False)
+        # Backend is chosen by OCR_ENGINE (easyocr | quantized | onnx), see services/ocr.py
+        _reader = ocr.create_engine()
     return _reader
 
-def process_image(image_path: str, output_dir: str):
+def process_image(image_path: str):
     """
     Segments the image into questions and performs OCR.
+    Only bboxes are returned; crops are rendered on demand by the /images endpoint.
     
     Args:
         image_path: Absolute path to the source image.
-        output_dir: Directory to save cropped question images.
         
     Returns:
         List of dictionaries containing question data.
@@ -75,32 +77,17 @@ def process_image(image_path: str, output_dir: str):
     # (x, y, w, h)
     bounding_boxes.sort(key=lambda b: b[1])
     
-    os.makedirs(output_dir, exist_ok=True)
-    
-    for i, bbox in enumerate(bounding_boxes):
-        x, y, w, h = bbox
+    for x, y, w, h in bounding_boxes:
         
         # Filter small noise (adjust thresholds as needed)
         if w < 100 or h < 50:
             continue
             
-        # Crop
-        crop = img[y:y+h, x:x+w]
-        
-        # Save Crop
-        crop_filename = f"crop_{uuid.uuid4()}.jpg"
-        crop_path_abs = os.path.join(output_dir, crop_filename)
-        cv2.imwrite(crop_path_abs, crop)
-        
-        # Relative path for frontend serving
-        # Assuming output_dir ends in "static/uploads"
-        # We want "static/uploads/crop_..." usually, but let's return just filename and let caller handle
-        
         # OCR (Using EasyOCR for better Chinese support)
         try:
             reader = get_reader()
-            # EasyOCR can take the crop directly as a numpy array
-            result = reader.readtext(crop, detail=0)
+            # EasyOCR takes the block as a numpy slice; the bbox is all that needs to be stored
+            result = reader.readtext(img[y:y+h, x:x+w], detail=0)
             text = " ".join(result)
         except Exception as e:
             # Fallback if OCR failed
@@ -109,7 +96,6 @@ def process_image(image_path: str, output_dir: str):
             
         question_blocks.append({
             "bbox": [x, y, w, h],
-            "image_filename": crop_filename,
             "ocr_text": text.strip()
         })
         
@@ -117,8 +103,6 @@ def process_image(image_path: str, output_dir: str):
         # Fallback: If no contours found (e.g. blank page or bad threshold), return full image as one question
         # This ensures the user at least sees something
         print("Warning: No distinct questions found. Returning full image.")
-        full_filename = f"full_{uuid.uuid4()}.jpg"
-        cv2.imwrite(os.path.join(output_dir, full_filename), img)
         try:
             reader = get_reader()
             result = reader.readtext(img, detail=0)
@@ -128,19 +112,21 @@ def process_image(image_path: str, output_dir: str):
         
         question_blocks.append({
             "bbox": [0, 0, img.shape[1], img.shape[0]],
-            "image_filename": full_filename,
             "ocr_text": text.strip()
         })
     
     return question_blocks
 
-def extract_text_full_page(image_path: str) -> str:
+def read_full_page(image_path: str):
     """
     Performs OCR on the full image without segmentation.
+    The lines are cleaned up by services/normalize before anything is sent to the LLM.
+    Returns a normalize.NormalizedPage (text plus token counts before/after cleanup),
+    or None if the image can't be read.
     """
     try:
         if not os.path.exists(image_path):
-             return ""
+             return None
         
         # Robust reading
         stream = np.fromfile(image_path, dtype=np.uint8)
@@ -149,13 +135,21 @@ def extract_text_full_page(image_path: str) -> str:
              img = cv2.imread(image_path)
         
         if img is None:
-             return ""
+             return None
+
+        # Boxes and confidences are kept (OCR_MODE=adaptive needs them, and so does normalization)
+        results = ocr.read_page(get_reader(), img)
+        if not NORMALIZE_OCR:
+            text = "\n".join(text for _, text, _ in results)
+            tokens = normalize.estimate_tokens(text)
+            return normalize.NormalizedPage(text, tokens, tokens)
 
-        reader = get_reader()
-        # detail=0 returns just the list of strings
-        result = reader.readtext(img, detail=0)
-        return "\n".join(result)
+        page = normalize.normalize_page(results, img.shape[0])
+        saved = page.tokens_before - page.tokens_after
+        print(f"OCR normalized: {page.tokens_before} -> {page.tokens_after} tokens "
+              f"(-{saved * 100 // max(page.tokens_before, 1)}%), dropped {page.dropped}")
+        return page
     except Exception as e:
-        print(f"Error in extract_text_full_page: {e}")
-        return ""
+        print(f"Error in read_full_page: {e}")
+        return None
 
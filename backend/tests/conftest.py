@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Must be set before anything imports app.database, so the suite never
+# touches the qsnap.db in the working tree.
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
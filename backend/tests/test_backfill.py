@@ -0,0 +1,176 @@
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import pytest
+
+from app import models
+from app.database import Base
+from app.services import backfill, solutions
+from app.services.backfill import BackfillRunner
+
+TIERS = {"fast": None, "strong": "strong-model"}
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # File DB: the runner writes from its own thread
+    engine = create_engine(f"sqlite:///{tmp_path / 'backfill.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    yield factory
+    engine.dispose()
+
+def _add_questions(factory, texts):
+    db = factory()
+    paper = models.Paper(filename="p.jpg", file_path="p.jpg")
+    db.add(paper)
+    db.flush()
+    questions = [models.Question(paper_id=paper.id, ocr_text=t, is_incomplete=False) for t in texts]
+    db.add_all(questions)
+    db.commit()
+    ids = [q.id for q in questions]
+    db.close()
+    return ids
+
+def _result(text, model="strong-model"):
+    return {"answer": f"A:{text}", "analysis": "...", "model": model, "escalated": False}
+
+@patch("app.services.routing.model_tiers", return_value=TIERS)
+def test_record_solution_versions_and_stale_detection(_, session_factory):
+    qid, = _add_questions(session_factory, ["1+1=?"])
+    db = session_factory()
+    q = db.get(models.Question, qid)
+
+    assert solutions.scan_stale(db, 0)[0] == [q]
+    solutions.record_solution(db, q, _result("v1"))
+    db.commit()
+    stale, skipped, last_id = solutions.scan_stale(db, 0)
+    assert (stale, skipped, last_id) == ([], 1, qid)
+    assert q.answer == "A:v1"
+
+    # Prompt bump makes it stale; re-solving keeps history with one current row
+    with patch.object(solutions, "SOLVER_PROMPT_VERSION", "2"):
+        assert solutions.scan_stale(db, 0)[0] == [q]
+        solutions.record_solution(db, q, _result("v2"))
+        db.commit()
+        assert solutions.scan_stale(db, 0)[0] == []
+    rows = db.query(models.Solution).filter_by(question_id=qid).order_by(models.Solution.id).all()
+    assert [(r.answer, r.is_current) for r in rows] == [("A:v1", False), ("A:v2", True)]
+
+    # Edited question text is stale too
+    q.ocr_text = "1+2=?"
+    db.commit()
+    assert solutions.is_stale(q, rows[-1])
+    db.close()
+
+@patch("app.services.routing.model_tiers", return_value=TIERS)
+def test_runner_resolves_only_stale_questions_and_checkpoints(_, session_factory):
+    ids = _add_questions(session_factory, ["q1", "q2", "q3"])
+    db = session_factory()
+    solutions.record_solution(db, db.get(models.Question, ids[1]), _result("q2"))
+    db.commit()
+
+    runner = BackfillRunner(session_factory=session_factory, sleep=lambda s: None)
+    with patch("app.services.routing.solve_question", side_effect=_result) as solve:
+        runner.start(rate_per_minute=6000)
+        runner.join(5)
+
+    assert [c.args[0] for c in solve.call_args_list] == ["q1", "q3"]
+    status = runner.status(db)
+    assert status["status"] == "completed"
+    assert (status["solved"], status["skipped"], status["last_question_id"]) == (2, 1, ids[-1])
+    assert status["tokens_used"] > 0
+    db.close()
+
+@patch("app.services.routing.model_tiers", return_value=TIERS)
+def test_runner_stops_at_token_budget_and_resumes(_, session_factory):
+    ids = _add_questions(session_factory, ["q1", "q2", "q3"])
+    runner = BackfillRunner(session_factory=session_factory, sleep=lambda s: None)
+
+    with patch("app.services.routing.solve_question", side_effect=_result) as solve:
+        runner.start(rate_per_minute=6000, token_budget=1)
+        runner.join(5)
+        assert solve.call_count == 1
+
+        db = session_factory()
+        status = runner.status(db)
+        assert status["status"] == "budget_exhausted"
+        assert status["last_question_id"] == ids[0]
+
+        # Topping up the budget resumes the same run after the checkpoint
+        run_id = runner.start(rate_per_minute=6000, token_budget=100000)
+        runner.join(5)
+        assert run_id == status["run_id"]
+        assert [c.args[0] for c in solve.call_args_list] == ["q1", "q2", "q3"]
+        assert runner.status(db)["status"] == "completed"
+        db.close()
+
+def test_runner_waits_while_live_traffic_is_pending():
+    runner = BackfillRunner(session_factory=None)
+    pending = iter([2, 1, 0])
+    naps = []
+    runner.sleep = naps.append
+    with patch.object(backfill.scheduler.llm, "pending", side_effect=lambda max_priority: next(pending)) as p:
+        runner._wait_for_idle_lane()
+    assert len(naps) == 2
+    assert p.call_args.kwargs["max_priority"] == backfill.scheduler.FRESH_UPLOAD
+
+@patch("app.services.routing.model_tiers", return_value=TIERS)
+def test_runner_survives_papers_deleted_mid_run(_, session_factory):
+    from sqlalchemy import text
+    from app.services import cancellation
+
+    q1, q2 = _add_questions(session_factory, ["q1", "q2"])
+    q3, q4 = _add_questions(session_factory, ["q3", "q4"])
+    db = session_factory()
+    paper_id = db.get(models.Question, q1).paper_id
+
+    def solve(question_text):
+        other = session_factory()
+        if question_text == "q1":
+            # DELETE /papers/{id}: cascade plus cancelling the paper's work
+            other.execute(text("DELETE FROM papers WHERE id = :id"), {"id": paper_id})
+            cancellation.cancel(cancellation.paper_scope(paper_id))
+        elif question_text == "q3":
+            # Removed behind the runner's back, without a cancel
+            other.execute(text("DELETE FROM questions WHERE id = :id"), {"id": q3})
+        other.commit()
+        other.close()
+        return _result(question_text)
+
+    runner = BackfillRunner(session_factory=session_factory, sleep=lambda s: None)
+    with patch("app.services.routing.solve_question", side_effect=solve) as mock_solve:
+        runner.start(rate_per_minute=6000)
+        runner.join(5)
+
+    assert [c.args[0] for c in mock_solve.call_args_list] == ["q1", "q3", "q4"]
+    status = runner.status(db)
+    assert status["status"] == "completed"
+    assert (status["solved"], status["skipped"], status["failed"]) == (1, 2, 1)
+    assert [s.question_id for s in db.query(models.Solution)] == [q4]
+    db.close()
+
+@patch("app.services.routing.model_tiers", return_value=TIERS)
+def test_failed_solve_keeps_existing_answer_and_stays_stale(_, session_factory):
+    qid, = _add_questions(session_factory, ["1+1=?"])
+    db = session_factory()
+    q = db.get(models.Question, qid)
+    solutions.record_solution(db, q, _result("old"))
+    db.commit()
+
+    error = {"answer": "", "analysis": "Error: OPENAI_API_KEY not found in environment.", "error": True}
+    assert solutions.record_solution(db, q, {**error, "model": "strong-model"}) is None
+
+    runner = BackfillRunner(session_factory=session_factory, sleep=lambda s: None)
+    with patch.object(solutions, "SOLVER_PROMPT_VERSION", "2"), \
+         patch("app.services.routing.solve_question", return_value={**error, "model": "strong-model"}):
+        runner.start(rate_per_minute=6000)
+        runner.join(5)
+        status = runner.status(db)
+        assert (status["solved"], status["failed"]) == (0, 1)
+        db.expire_all()
+        q = db.get(models.Question, qid)
+        assert q.answer == "A:old"
+        assert db.query(models.Solution).count() == 1
+        # Still picked up by the next run once the provider is back
+        assert solutions.scan_stale(db, 0)[0] == [q]
+    db.close()
@@ -0,0 +1,254 @@
+import json
+import os
+import threading
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import Base
+from app.services import batch, solutions
+
+TIERS = {"fast": None, "strong": "strong-model"}
+
+
+class StubBatchAPI:
+    """
+    Minimal OpenAI-compatible files + batches API. Each batch reports in_progress on the first
+    retrieve and completed afterwards; responder(request line) -> (status_code, content).
+    """
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.files = {}
+        self.batches = {}
+        self.uploads = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, payload, raw=False):
+                body = payload if raw else json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream" if raw else "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.path == "/v1/files":
+                    message = BytesParser(policy=policy.default).parsebytes(
+                        f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+                    )
+                    content = next(
+                        part.get_payload(decode=True) for part in message.iter_parts()
+                        if part.get_param("name", header="content-disposition") == "file"
+                    )
+                    stub.uploads.append(content.decode("utf-8"))
+                    self._send(stub._file(content))
+                elif self.path == "/v1/batches":
+                    self._send(stub._create_batch(json.loads(body)))
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                if parts[:2] == ["v1", "batches"]:
+                    self._send(stub._retrieve(parts[2]))
+                elif parts[:2] == ["v1", "files"] and parts[3:] == ["content"]:
+                    self._send(stub.files[parts[2]], raw=True)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _file(self, content: bytes) -> dict:
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": 0,
+                "filename": "batch.jsonl", "purpose": "batch"}
+
+    def _create_batch(self, params: dict) -> dict:
+        lines = []
+        for line in self.files[params["input_file_id"]].decode("utf-8").splitlines():
+            request = json.loads(line)
+            status, content = self.responder(request)
+            lines.append(json.dumps({
+                "id": f"req-{len(lines)}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": status, "body": (
+                    {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+                    if status == 200 else {"error": {"message": content}}
+                )},
+                "error": None,
+            }, ensure_ascii=False))
+        output = self._file("\n".join(lines).encode("utf-8"))
+        batch_id = f"batch-{len(self.batches) + 1}"
+        self.batches[batch_id] = {"params": params, "output_file_id": output["id"], "polls": 0}
+        return self._batch(batch_id, "validating")
+
+    def _retrieve(self, batch_id: str) -> dict:
+        state = self.batches[batch_id]
+        state["polls"] += 1
+        return self._batch(batch_id, "in_progress" if state["polls"] == 1 else "completed")
+
+    def _batch(self, batch_id: str, status: str) -> dict:
+        state = self.batches[batch_id]
+        return {
+            "id": batch_id, "object": "batch", "endpoint": state["params"]["endpoint"],
+            "input_file_id": state["params"]["input_file_id"], "completion_window": "24h",
+            "created_at": 0, "status": status,
+            "output_file_id": state["output_file_id"] if status == "completed" else None,
+            "error_file_id": None,
+        }
+
+    def close(self):
+        self.server.shutdown()
+
+
+def _answer(request):
+    question = request["body"]["messages"][-1]["content"]
+    if "坏" in question:
+        return 200, "完全不是 JSON"
+    return 200, json.dumps({"answer": "A", "analysis": f"解析 {request['custom_id']}"}, ensure_ascii=False)
+
+
+@pytest.fixture
+def api():
+    stub = StubBatchAPI(_answer)
+    # The batch model is deliberately not one of the routing tiers
+    env = {"OPENAI_API_KEY": "test-key", "OPENAI_API_BASE": stub.url, "LLM_MODEL": "strong-model",
+           "LLM_BATCH_MODEL": "batch-model", "LLM_JSON_MODE": "1"}
+    with patch.dict(os.environ, env), patch("app.services.routing.model_tiers", return_value=TIERS):
+        yield stub
+    stub.close()
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'batch.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def _questions(db, texts):
+    paper = models.Paper(filename="p.jpg", file_path="p.jpg")
+    db.add(paper)
+    db.flush()
+    questions = [models.Question(paper_id=paper.id, ocr_text=t, is_incomplete=False) for t in texts]
+    db.add_all(questions)
+    db.commit()
+    return questions
+
+
+def test_solve_batch_round_trip_is_idempotent(api, session_factory):
+    db = session_factory()
+    q1, q2, q3 = _questions(db, ["1+1=?", "2+2=?", "坏题"])
+
+    job = batch.submit(db, "solve", batch.collect_stale(db))
+    assert job.request_count == 3
+    request = json.loads(api.uploads[0].splitlines()[0])
+    assert request["custom_id"] == batch.custom_id("solve", q1)
+    assert request["url"] == "/v1/chat/completions"
+    assert request["body"]["response_format"] == {"type": "json_object"}
+    assert "1+1=?" in request["body"]["messages"][1]["content"]
+
+    # Queued questions aren't collected or submitted again while the job is open
+    assert batch.collect_stale(db) == []
+    assert batch.submit(db, "solve", [q1]) is None
+
+    assert batch.refresh(db, job).status == "in_progress"
+    batch.refresh(db, job)
+    assert (job.status, job.applied, job.failed) == ("applied", 2, 1)
+    assert q1.answer == "A" and q1.analysis == f"解析 {batch.custom_id('solve', q1)}"
+    current = q2.solutions[-1]
+    assert (current.model, current.prompt_version, current.is_current) == ("batch-model", job.prompt_version, True)
+    assert request["body"]["model"] == "batch-model"
+
+    # Unparseable result stays stale for the next batch; re-applying the output changes nothing
+    assert [q.id for q in batch.collect_stale(db)] == [q3.id]
+    output = api.files[job.output_file_id].decode("utf-8")
+    assert batch.apply_results(db, job, output) == {"applied": 0, "skipped": 2, "failed": 1}
+    assert db.query(models.Solution).count() == 2
+    db.close()
+
+
+def test_results_for_edited_or_deleted_questions_are_skipped(api, session_factory):
+    db = session_factory()
+    q1, q2 = _questions(db, ["1+1=?", "2+2=?"])
+    job = batch.submit(db, "solve", [q1, q2])
+
+    q1.ocr_text = "1+2=?"
+    db.delete(q2)
+    db.commit()
+    batch.refresh(db, job)
+    batch.refresh(db, job)
+
+    assert (job.applied, job.skipped) == (0, 2)
+    assert q1.answer == ""
+    db.close()
+
+
+def test_format_batch_updates_text(api, session_factory):
+    api.responder = lambda request: (200, '{"formatted_text": "1. 1+1=?\\nA. 2", "is_complete": true}')
+    db = session_factory()
+    q1, = _questions(db, ["1 1+1=? A 2"])
+    q1.is_incomplete = None
+    db.commit()
+
+    job = batch.submit(db, "format", [q1])
+    batch.refresh(db, job)
+    batch.refresh(db, job)
+
+    assert job.status == "applied"
+    assert q1.ocr_text == "1. 1+1=?\nA. 2"
+    assert q1.is_incomplete is False
+    # The text changed, so its solution (none yet) is stale and the next solve batch takes it
+    assert solutions.scan_stale(db, 0)[0] == [q1]
+    db.close()
+
+
+def test_poller_applies_results_and_stops_when_nothing_is_open(api, session_factory):
+    db = session_factory()
+    q1, = _questions(db, ["1+1=?"])
+    job_id, question_id = batch.submit(db, "solve", [q1]).id, q1.id
+    db.close()
+
+    poller = batch.BatchPoller(session_factory=session_factory, sleep=lambda s: None)
+    poller.start()
+    poller.join(5)
+
+    db = session_factory()
+    assert db.get(models.BatchJob, job_id).status == "applied"
+    assert db.get(models.Question, question_id).answer == "A"
+    db.close()
+
+def test_malformed_output_lines_fail_individually(api, session_factory):
+    db = session_factory()
+    q1, q2 = _questions(db, ["1+1=?", "2+2=?"])
+    job = batch.submit(db, "solve", [q1, q2])
+    good = json.dumps({
+        "custom_id": batch.custom_id("solve", q2),
+        "response": {"status_code": 200, "body": {"choices": [{"message": {"content": '{"answer": "4", "analysis": "2+2"}'}}]}},
+    })
+    output = "\n".join([
+        "{not json",
+        json.dumps({"custom_id": batch.custom_id("solve", q1), "response": {"status_code": 200, "body": {"choices": []}}}),
+        json.dumps({"no_custom_id": True}),
+        good,
+    ])
+
+    assert batch.apply_results(db, job, output) == {"applied": 1, "skipped": 0, "failed": 3}
+    assert q2.answer == "4"
+    db.commit()
+    # Recorded with the batch model, which counts as an up-to-date model
+    current = db.query(models.Solution).filter_by(question_id=q2.id, is_current=True).one()
+    assert not solutions.is_stale(q2, current)
+    db.close()
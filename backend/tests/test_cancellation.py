@@ -0,0 +1,36 @@
+from concurrent.futures import Future, CancelledError
+import pytest
+from app.services import cancellation
+
+def test_cancel_drops_tracked_futures_and_resets_scope():
+    scope = ("paper", 123)
+    token = cancellation.token_for(scope)
+    assert cancellation.token_for(scope) is token
+
+    queued = token.track(Future())
+    cancellation.cancel(scope)
+
+    assert token.cancelled
+    assert queued.cancelled()
+    with pytest.raises(CancelledError):
+        token.raise_if_cancelled()
+    # A new run of the same paper gets a fresh token
+    assert cancellation.token_for(scope) is not token
+    cancellation.cancel(scope)
+
+def test_track_after_cancel_cancels_immediately():
+    token = cancellation.CancelToken()
+    token.cancel()
+    assert token.track(Future()).cancelled()
+
+def test_scope_is_forgotten_once_every_holder_released():
+    scope = ("paper", 456)
+    token = cancellation.token_for(scope)
+    cancellation.retain(token)
+    cancellation.release(token)
+    assert cancellation.token_for(scope) is token
+    cancellation.release(token)
+    cancellation.release(token)
+    assert scope not in cancellation._tokens
+    assert cancellation.token_for(scope) is not token
+    cancellation.cancel(scope)
@@ -0,0 +1,77 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import Base, migrate
+from app.services import search, solutions
+
+# Schema of a database created by the first release (questions.paper_id without ON DELETE CASCADE)
+BASELINE_SCHEMA = [
+    """CREATE TABLE papers (
+        id INTEGER NOT NULL, filename VARCHAR, file_path VARCHAR, created_at DATETIME,
+        is_processed BOOLEAN, PRIMARY KEY (id))""",
+    """CREATE TABLE questions (
+        id INTEGER NOT NULL, paper_id INTEGER, image_path VARCHAR, bbox_json VARCHAR, ocr_text TEXT,
+        solution_text TEXT, order_index INTEGER, is_incomplete BOOLEAN DEFAULT 0,
+        answer TEXT DEFAULT '', analysis TEXT DEFAULT '',
+        PRIMARY KEY (id), FOREIGN KEY(paper_id) REFERENCES papers (id))""",
+    "CREATE INDEX ix_papers_id ON papers (id)",
+    "CREATE INDEX ix_papers_filename ON papers (filename)",
+    "CREATE INDEX ix_questions_id ON questions (id)",
+    "INSERT INTO papers (id, filename, file_path, is_processed) VALUES (1, 'old.jpg', 'old.jpg', 1)",
+    "INSERT INTO questions (id, paper_id, ocr_text, order_index) VALUES (1, 1, '求二次函数的顶点', 1)",
+]
+
+
+def test_baseline_database_migrates_with_working_solutions_and_search(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}", connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.exec_driver_sql(statement)
+
+    # Same startup sequence as app.main
+    Base.metadata.create_all(bind=engine)
+    migrate(engine)
+    search.ensure_index(engine)
+
+    with engine.connect() as conn:
+        fks = conn.exec_driver_sql("PRAGMA foreign_key_list(solutions)").fetchall()
+        assert {fk[2] for fk in fks} == {"questions"}
+        assert conn.exec_driver_sql("PRAGMA foreign_key_list(questions)").fetchall()[0][6] == "CASCADE"
+        assert conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'questions'"
+        ).fetchall() == [("questions_fts_delete",)]
+
+    db = sessionmaker(bind=engine)()
+    question = db.get(models.Question, 1)
+    solutions.record_solution(db, question, {"answer": "(0, 0)", "analysis": "配方", "model": "m"})
+    db.commit()
+    assert db.query(models.Solution).count() == 1
+    assert search.search(db, "顶点")[0] == 1
+
+    # Deleting the paper cascades to questions, their solutions and the search index
+    db.execute(text("DELETE FROM papers WHERE id = 1"))
+    db.commit()
+    assert db.query(models.Question).count() == 0
+    assert db.query(models.Solution).count() == 0
+    assert search.search(db, "顶点")[0] == 0
+    db.close()
+    engine.dispose()
+
+
+def test_schema_is_set_up_on_startup_not_on_import():
+    from fastapi.testclient import TestClient
+    from sqlalchemy import inspect
+    from app.database import SQLALCHEMY_DATABASE_URL, engine
+    from app.main import app
+
+    assert "qsnap.db" not in SQLALCHEMY_DATABASE_URL
+    engine.dispose()
+    with engine.begin() as conn:
+        for table in ("questions_fts", "solutions", "questions", "papers"):
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+    assert not inspect(engine).has_table("questions")
+    with TestClient(app):
+        assert inspect(engine).has_table("questions")
+        assert inspect(engine).has_table("solutions")
@@ -0,0 +1,65 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from app.services import images
+
+@pytest.fixture
+def original(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, "CACHE_DIR", str(tmp_path / "cache"))
+    path = str(tmp_path / "page.png")
+    cv2.imwrite(path, np.zeros((600, 900, 3), dtype=np.uint8))
+    return path
+
+def test_bucket_width_rounds_up_and_caps():
+    assert images.bucket_width(None) is None
+    assert images.bucket_width(100) == 160
+    assert images.bucket_width(700) == 960
+    assert images.bucket_width(10000) == 1920
+
+def test_parse_bbox_formats():
+    assert images.parse_bbox("[]") == []
+    assert images.parse_bbox("[1, 2, 3, 4]") == [1, 2, 3, 4]
+    assert images.parse_bbox("1,2,3,4") == [1, 2, 3, 4]
+    with pytest.raises(ValueError):
+        images.parse_bbox("1,2")
+
+def test_render_is_cached_and_keyed_by_content(original):
+    first = images.render(original, [0, 0, 450, 300], 160, "jpeg")
+    assert images.render(original, [0, 0, 450, 300], 160, "jpeg") == first
+    assert cv2.imread(first).shape[:2] == (107, 160)
+
+    old_key = images.derivative_key(images.file_digest(original), [], None, "jpeg")
+    cv2.imwrite(original, np.full((600, 900, 3), 255, dtype=np.uint8))
+    os.utime(original, ns=(1, 1))
+    assert images.derivative_key(images.file_digest(original), [], None, "jpeg") != old_key
+
+def test_evict_drops_least_recently_used(original):
+    old = images.render(original, [], 160, "jpeg")
+    os.utime(old, (1, 1))
+    new = images.render(original, [], 320, "jpeg")
+
+    images.evict(max_bytes=os.path.getsize(new))
+
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+
+def test_cache_size_is_tracked_without_walking_on_every_miss(original, monkeypatch):
+    first = images.render(original, [], 160, "jpeg")
+    size = os.path.getsize(first)
+    monkeypatch.setattr(images, "CACHE_MAX_BYTES", size * 3)
+
+    walks = []
+    real_walk = os.walk
+    monkeypatch.setattr(images.os, "walk", lambda top: walks.append(top) or real_walk(top))
+
+    images.render(original, [], 320, "jpeg")
+    assert walks == []
+    assert images._cache_bytes[images.CACHE_DIR] == size + os.path.getsize(images.render(original, [], 320, "jpeg"))
+
+    # Crossing the limit walks once and trims below it
+    for width in (480, 640, 960):
+        images.render(original, [], width, "jpeg")
+    assert len(walks) >= 1
+    assert images._cache_bytes[images.CACHE_DIR] <= images.CACHE_MAX_BYTES
+    assert not os.path.exists(first)
@@ -1,10 +1,11 @@
 from unittest.mock import patch, MagicMock
 import os
+import pytest
 from app.services.llm import solve_question
 
 def test_solve_question_empty_input():
     result = solve_question("")
-    assert result == "No question text provided."
+    assert result == {"answer": "", "analysis": "No question text provided.", "error": True}
 
 def test_solve_question_no_api_key():
     # Save original env
@@ -13,7 +14,7 @@ def test_solve_question_no_api_key():
         if "OPENAI_API_KEY" in os.environ:
             del os.environ["OPENAI_API_KEY"]
         result = solve_question("Question?")
-        assert "Error: OPENAI_API_KEY not found" in result
+        assert "Error: OPENAI_API_KEY not found" in result["analysis"]
     finally:
         os.environ.clear()
         os.environ.update(old_env)
@@ -42,24 +43,25 @@ def test_solve_question_success(mock_parser_cls, mock_prompt_cls, mock_openai_cl
     mock_intermediate.__or__.return_value = mock_final_chain
     
     # Setup return value
-    mock_final_chain.invoke.return_value = "The answer is 42."
+    mock_final_chain.invoke.return_value = '{"answer": "42", "analysis": "The answer is 42."}'
     
     # Ensure environment has API key
     # Also unset OPENAI_API_BASE if present to match the expected call with base_url=None
     # Or just don't check base_url strictly if not knowing the env
-    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key", "LLM_MODEL": "gpt-3.5-turbo"}):
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key", "LLM_MODEL": "gpt-3.5-turbo", "LLM_JSON_MODE": "1"}):
         if "OPENAI_API_BASE" in os.environ:
              del os.environ["OPENAI_API_BASE"]
              
         result = solve_question("What is the meaning of life?")
         
-        assert result == "The answer is 42."
+        assert result == {"answer": "42", "analysis": "The answer is 42."}
         mock_openai_cls.assert_called_with(
             model="gpt-3.5-turbo",
             base_url=None,
             api_key="test-key",
             temperature=0.3
         )
+        mock_llm_instance.bind.assert_called_once_with(response_format={"type": "json_object"})
         mock_final_chain.invoke.assert_called_once()
 
 @patch("app.services.llm.ChatOpenAI")
@@ -67,4 +69,130 @@ def test_solve_question_exception(mock_openai):
     mock_openai.side_effect = Exception("API Error")
     with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
         result = solve_question("Question")
-        assert "Error generating solution" in result
+        assert result["answer"] == ""
+        assert "Error generating solution" in result["analysis"]
+
+def _mock_chain(mock_prompt_cls):
+    chain = MagicMock()
+    mock_prompt_cls.from_messages.return_value.__or__.return_value.__or__.return_value = chain
+    return chain
+
+@patch("app.services.llm.ChatOpenAI")
+@patch("app.services.llm.ChatPromptTemplate")
+def test_solve_question_repairs_locally_without_second_call(mock_prompt_cls, mock_openai_cls):
+    chain = _mock_chain(mock_prompt_cls)
+    # Fenced, trailing prose, unescaped LaTeX (\frac parses as a form feed, \sqrt doesn't parse)
+    chain.invoke.return_value = '好的：\n```json\n{"answer": "$\\frac{1}{2}$", "analysis": "$\\sqrt{4}=2$",}\n```\n希望有帮助'
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+        result = solve_question("Question")
+
+    assert result == {"answer": "$\\frac{1}{2}$", "analysis": "$\\sqrt{4}=2$"}
+    chain.invoke.assert_called_once()
+
+@patch("app.services.llm.ChatOpenAI")
+@patch("app.services.llm.ChatPromptTemplate")
+def test_solve_question_retries_once_only_when_repair_fails(mock_prompt_cls, mock_openai_cls):
+    chain = _mock_chain(mock_prompt_cls)
+    chain.invoke.side_effect = ["答案是 C", '{"answer": "C", "analysis": "..."}']
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+        assert solve_question("Question") == {"answer": "C", "analysis": "..."}
+
+    assert chain.invoke.call_count == 2
+    retry_inputs = chain.invoke.call_args.args[0]
+    assert retry_inputs["previous_output"] == "答案是 C"
+    assert "error" in retry_inputs
+
+@patch("app.services.llm.ChatOpenAI")
+@patch("app.services.llm.ChatPromptTemplate")
+def test_solve_question_keeps_text_when_retry_fails_too(mock_prompt_cls, mock_openai_cls):
+    chain = _mock_chain(mock_prompt_cls)
+    chain.invoke.side_effect = ["答案是 C", "还是 C"]
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+        assert solve_question("Question") == {"answer": "", "analysis": "还是 C"}
+
+@patch("app.services.llm.ChatOpenAI")
+@patch("app.services.llm.ChatPromptTemplate")
+def test_json_mode_is_dropped_for_models_that_reject_it(mock_prompt_cls, mock_openai_cls):
+    from app.services import structured
+    chain = _mock_chain(mock_prompt_cls)
+    chain.invoke.side_effect = [Exception("400: response_format is not supported"), '{"answer": "C"}']
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key", "LLM_JSON_MODE": "auto"}), \
+         patch.object(structured, "_json_mode_unsupported", set()):
+        assert solve_question("Question", model="no-json-model")["answer"] == "C"
+        assert not structured.json_mode_enabled("no-json-model")
+    assert mock_openai_cls.return_value.bind.call_count == 1
+
+from app.services.llm import QuestionStreamParser, stream_split_questions, format_and_check_question
+
+def test_question_stream_parser_emits_each_question_when_complete():
+    parser = QuestionStreamParser()
+    chunks = ['```json\n{"ques', 'tions": ["1. 第一题', '，含\\"引号\\"", "2. [x] {y}', '", "3. 第三', '题"]}\n```']
+    emitted = [parser.feed(c) for c in chunks]
+
+    assert emitted == [[], [], ['1. 第一题，含"引号"'], ["2. [x] {y}"], ["3. 第三题"]]
+    assert parser.emitted == 3
+
+def test_question_stream_parser_accepts_bare_list_and_objects():
+    parser = QuestionStreamParser()
+    assert parser.feed('[{"question": "Q1"}, "Q2"]') == ["Q1", "Q2"]
+
+@patch("app.services.llm.ChatOpenAI")
+@patch("app.services.llm.ChatPromptTemplate")
+@patch("app.services.llm.StrOutputParser")
+def test_stream_split_questions_yields_incrementally(mock_parser_cls, mock_prompt_cls, mock_openai_cls):
+    mock_chain = MagicMock()
+    mock_prompt_cls.from_messages.return_value.__or__.return_value.__or__.return_value = mock_chain
+    mock_chain.stream.return_value = iter(['{"questions": ["Q1"', ', "Q2"]}'])
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+        stream = stream_split_questions("Q1\n\nQ2")
+        assert next(stream) == "Q1"
+        assert list(stream) == ["Q2"]
+
+@patch("app.services.llm.ChatOpenAI")
+@patch("app.services.llm.ChatPromptTemplate")
+def test_stream_split_questions_repairs_output_the_stream_parser_missed(mock_prompt_cls, mock_openai_cls):
+    chain = _mock_chain(mock_prompt_cls)
+    # Truncated before the first string even closed
+    chain.stream.return_value = iter(['{"questions": ["1. 求 $\\alpha$ 的值'])
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+        assert list(stream_split_questions("raw")) == ["1. 求 $\\alpha$ 的值"]
+
+@patch("app.services.llm.ChatOpenAI")
+@patch("app.services.llm.ChatPromptTemplate")
+def test_stream_split_questions_raises_when_stream_breaks_after_a_question(mock_prompt_cls, mock_openai_cls):
+    chain = _mock_chain(mock_prompt_cls)
+
+    def broken_stream(_):
+        yield '{"questions": ["Q1", "Q'
+        raise ConnectionError("stream reset")
+    chain.stream.side_effect = broken_stream
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+        stream = stream_split_questions("Q1\n\nQ2")
+        assert next(stream) == "Q1"
+        with pytest.raises(ConnectionError):
+            list(stream)
+
+@patch("app.services.llm.ChatOpenAI")
+def test_stream_split_questions_falls_back_to_paragraphs(mock_openai):
+    mock_openai.side_effect = Exception("API Error")
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+        assert list(stream_split_questions("Q1\n\nQ2\n\n")) == ["Q1", "Q2"]
+
+@patch("app.services.llm.ChatOpenAI")
+def test_format_and_check_question_keeps_text_on_failure(mock_openai):
+    mock_openai.side_effect = Exception("API Error")
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+        assert format_and_check_question("1+1=?") == {"formatted_text": "1+1=?", "is_complete": True}
+
+def test_estimate_tokens_counts_cjk_per_character():
+    from app.services.llm import estimate_tokens
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("求解方程") == 4
+    assert estimate_tokens("abcdefgh") == 2
@@ -7,6 +7,7 @@ import pytest
 
 from app.main import app
 from app.database import Base, get_db
+from app.services.normalize import NormalizedPage
 
 # Setup In-Memory DB for testing
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -29,6 +30,9 @@ app.dependency_overrides[get_db] = override_get_db
 
 client = TestClient(app)
 
+def _ocr_page(text, tokens_before=10, tokens_after=10):
+    return NormalizedPage(text, tokens_before, tokens_after)
+
 @pytest.fixture(autouse=True)
 def setup_db():
     Base.metadata.create_all(bind=engine)
@@ -67,3 +71,503 @@ def test_upload_paper(cleanup_upload):
     data = response.json()
     assert "id" in data
     assert data["filename"] == test_filename
+
+def test_delete_paper_cascades_questions_and_cancels_work(cleanup_upload):
+    from app import models
+    from app.services import cancellation
+
+    file_path = "static/uploads/test_delete_paper.jpg"
+    cleanup_upload.append(file_path)
+    with open(file_path, "wb") as f:
+        f.write(b"fake image content")
+
+    db = TestingSessionLocal()
+    paper = models.Paper(filename="test_delete_paper.jpg", file_path=file_path)
+    paper.questions = [models.Question(ocr_text="Q1"), models.Question(ocr_text="Q2")]
+    db.add(paper)
+    db.commit()
+    paper_id = paper.id
+    token = cancellation.token_for(cancellation.paper_scope(paper_id))
+
+    response = client.delete(f"/papers/{paper_id}")
+
+    assert response.status_code == 200
+    assert token.cancelled
+    assert db.query(models.Question).count() == 0
+    # File cleanup runs as a background task after the response
+    assert not os.path.exists(file_path)
+    db.close()
+
+def test_process_paper_persists_and_queues_each_streamed_question(cleanup_upload):
+    import time
+    from unittest.mock import patch
+    from app import models
+
+    db = TestingSessionLocal()
+    paper = models.Paper(filename="stream.jpg", file_path="static/uploads/stream.jpg")
+    db.add(paper)
+    db.commit()
+    paper_id = paper.id
+
+    seen_rows = []
+    def fake_stream(full_text):
+        for expected, text in enumerate(["1. 第一题", "2. 第二题"], 1):
+            yield text
+            # The question is persisted while the splitter is still running
+            check_db = TestingSessionLocal()
+            for _ in range(500):
+                if check_db.query(models.Question).count() >= expected:
+                    break
+                time.sleep(0.01)
+            seen_rows.append(check_db.query(models.Question).count())
+            check_db.close()
+
+    with patch("app.services.pipeline.SessionLocal", TestingSessionLocal), \
+         patch("app.services.pipeline.vision.read_full_page", return_value=_ocr_page("raw", 12, 5)), \
+         patch("app.services.pipeline.llm.stream_split_questions", side_effect=fake_stream), \
+         patch("app.services.pipeline.solve_question_in_background") as mock_solve:
+        response = client.post(f"/process/{paper_id}")
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "processing_started", "questions_found": 2}
+    assert seen_rows == [1, 2]
+    questions = db.query(models.Question).order_by(models.Question.order_index).all()
+    assert [q.ocr_text for q in questions] == ["1. 第一题", "2. 第二题"]
+    db.expire_all()
+    paper = db.get(models.Paper, paper_id)
+    assert paper.is_processed
+    # The normalization saving is kept on the paper
+    assert (paper.ocr_tokens_before, paper.ocr_tokens_after) == (12, 5)
+    assert mock_solve.call_count == 2
+    db.close()
+
+def test_process_paper_broken_split_leaves_paper_unprocessed_without_partial_questions():
+    from unittest.mock import patch
+    from app import models
+
+    db = TestingSessionLocal()
+    paper = models.Paper(filename="broken.jpg", file_path="static/uploads/broken.jpg")
+    db.add(paper)
+    db.commit()
+    paper_id = paper.id
+
+    def broken_stream(full_text):
+        yield "1. 第一题"
+        raise ConnectionError("stream reset")
+
+    with patch("app.services.pipeline.SessionLocal", TestingSessionLocal), \
+         patch("app.services.pipeline.vision.read_full_page", return_value=_ocr_page("raw")), \
+         patch("app.services.pipeline.llm.stream_split_questions", side_effect=broken_stream), \
+         patch("app.services.pipeline.solve_question_in_background"):
+        response = client.post(f"/process/{paper_id}")
+
+    assert response.status_code == 500
+    db.expire_all()
+    assert not db.get(models.Paper, paper_id).is_processed
+    assert db.query(models.Question).count() == 0
+    db.close()
+
+def _zip_bytes(members):
+    import io
+    import zipfile
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+def test_ingest_creates_all_papers_and_starts_pipeline(cleanup_upload):
+    from unittest.mock import patch
+    from app import models
+
+    archive = _zip_bytes({
+        "class/IMG_0001.jpg": b"page 2",
+        "class/IMG_0002.png": b"page 3",
+        "class/notes.txt": b"not an image",
+        "__MACOSX/class/._IMG_0001.jpg": b"junk",
+    })
+    files = [
+        ("files", ("IMG_0001.jpg", b"page 1", "image/jpeg")),
+        ("files", ("class.zip", archive, "application/zip")),
+    ]
+
+    with patch("app.routers.ingest.pipeline.run_batch") as mock_run_batch:
+        response = client.post("/ingest", files=files)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["papers"] == 3
+
+    db = TestingSessionLocal()
+    papers = db.query(models.Paper).filter(models.Paper.batch_id == data["batch_id"]).all()
+    cleanup_upload.extend(p.file_path for p in papers)
+    assert sorted(p.filename for p in papers) == ["IMG_0001.jpg", "IMG_0001.jpg", "IMG_0002.png"]
+    # Same original name twice, but stored as separate files
+    assert len({p.file_path for p in papers}) == 3
+    assert all(os.path.exists(p.file_path) for p in papers)
+    mock_run_batch.assert_called_once()
+    assert mock_run_batch.call_args[0][:2] == (data["batch_id"], data["paper_ids"])
+    db.close()
+
+def test_ingest_rejects_upload_without_images():
+    response = client.post("/ingest", files=[("files", ("notes.txt", b"text", "text/plain"))])
+    assert response.status_code == 400
+
+def test_run_batch_pipelines_ocr_into_split_and_reports_progress(tmp_path):
+    import threading
+    from unittest.mock import patch
+    from app import models
+    from app.services import pipeline
+
+    # OCR and LLM lanes write from different threads, so use a file DB rather than the shared
+    # single-connection in-memory one
+    file_engine = create_engine(f"sqlite:///{tmp_path / 'batch.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=file_engine)
+    FileSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=file_engine)
+
+    db = FileSessionLocal()
+    papers = [models.Paper(filename=f"p{i}.jpg", file_path=f"static/uploads/p{i}.jpg", batch_id="b1") for i in range(5)]
+    # Already processed before the batch ran
+    papers[4].is_processed = True
+    db.add_all(papers)
+    db.commit()
+    paper_ids = [p.id for p in papers]
+
+    ocr_calls = []
+    p0_started, release_p0 = threading.Event(), threading.Event()
+    def fake_ocr(path):
+        name = os.path.basename(path)
+        ocr_calls.append(name)
+        if name == "p0.jpg":
+            p0_started.set()
+            release_p0.wait(5)
+        if name == "p2.jpg":
+            raise ValueError("unreadable")
+        # An image with nothing recognised
+        return "" if name == "p3.jpg" else f"text of {name}"
+
+    def fake_split(full_text):
+        yield f"Q1 {full_text}"
+        yield f"Q2 {full_text}"
+
+    with patch("app.services.pipeline.SessionLocal", FileSessionLocal), \
+         patch("app.services.pipeline.vision.read_full_page", side_effect=lambda path: _ocr_page(fake_ocr(path))), \
+         patch("app.services.pipeline.llm.stream_split_questions", side_effect=fake_split), \
+         patch("app.services.pipeline.solve_question_in_background"):
+        batch = threading.Thread(target=pipeline.run_batch, args=("b1", paper_ids, "teacher"))
+        batch.start()
+        assert p0_started.wait(5)
+        # POST /process on a page the batch is still working on joins the batch's run
+        manual = []
+        joiner = threading.Thread(target=lambda: manual.append(pipeline.process_paper(paper_ids[0], "teacher")))
+        joiner.start()
+        release_p0.set()
+        batch.join(10)
+        joiner.join(10)
+
+    assert ocr_calls.count("p0.jpg") == 1
+    # Either joined the in-flight run or found the page processed; never a second insert
+    assert manual[0]["questions_found"] == 2
+    progress = pipeline.batch_progress(db, "b1")
+    assert progress["papers"] == 5
+    assert progress["ocr_done"] == 3
+    assert progress["papers_processed"] == 3
+    assert progress["failed"] == 2
+    assert progress["questions"] == 4
+    assert progress["questions_solved"] == 0
+    assert not progress["done"]
+    assert pipeline.batch_progress(db, "unknown") is None
+    db.close()
+
+def test_ingest_progress_unknown_batch():
+    assert client.get("/ingest/unknown").status_code == 404
+
+def test_batch_progress_counts_failed_solves_as_settled_and_forgets_old_batches(tmp_path):
+    import time
+    from unittest.mock import patch
+    from app import models
+    from app.services import pipeline
+
+    file_engine = create_engine(f"sqlite:///{tmp_path / 'batch.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=file_engine)
+    FileSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=file_engine)
+
+    db = FileSessionLocal()
+    paper = models.Paper(filename="p.jpg", file_path="static/uploads/p.jpg", batch_id="b2")
+    db.add(paper)
+    db.commit()
+
+    # Nothing has been OCR'd yet
+    assert pipeline.batch_progress(db, "b2")["ocr_done"] == 0
+
+    def fake_solve(text):
+        if text.startswith("Q2"):
+            return {"answer": "", "analysis": "Error: upstream timeout", "error": True}
+        return {"answer": "A", "analysis": "..."}
+
+    with patch("app.services.pipeline.SessionLocal", FileSessionLocal), \
+         patch("app.services.pipeline.vision.read_full_page", return_value=_ocr_page("raw")), \
+         patch("app.services.pipeline.llm.stream_split_questions", side_effect=lambda text: iter(["Q1 a", "Q2 b"])), \
+         patch("app.services.pipeline.llm.format_and_check_question",
+               side_effect=lambda text: {"formatted_text": text, "is_complete": True}), \
+         patch("app.services.pipeline.routing.solve_question", side_effect=fake_solve):
+        pipeline.run_batch("b2", [paper.id], "teacher")
+        for _ in range(500):
+            progress = pipeline.batch_progress(db, "b2")
+            if progress["done"]:
+                break
+            time.sleep(0.01)
+
+    assert progress["questions_solved"] == 1
+    assert progress["questions_failed"] == 1
+    assert progress["done"]
+
+    # Finished batches are dropped once they expire
+    with patch("app.services.pipeline.BATCH_TTL_SECONDS", -1), pipeline._batches_lock:
+        pipeline._prune_batches()
+    assert "b2" not in pipeline._batches
+    assert pipeline.batch_progress(db, "b2")["ocr_done"] == 0
+    db.close()
+
+@pytest.fixture
+def stored_page(cleanup_upload, tmp_path, monkeypatch):
+    import cv2
+    import numpy as np
+    from app import models
+    from app.services import images
+
+    monkeypatch.setattr(images, "CACHE_DIR", str(tmp_path / "cache"))
+    file_path = "static/uploads/test_image_page.png"
+    cleanup_upload.append(file_path)
+    page = np.full((1000, 800, 3), 255, dtype=np.uint8)
+    cv2.imwrite(file_path, page)
+
+    db = TestingSessionLocal()
+    paper = models.Paper(filename="test_image_page.png", file_path=file_path)
+    paper.questions = [models.Question(image_path=file_path, bbox_json="[100, 200, 400, 300]", ocr_text="Q1")]
+    db.add(paper)
+    db.commit()
+    ids = (paper.id, paper.questions[0].id)
+    db.close()
+    return ids
+
+def test_question_image_redirects_to_immutable_cropped_thumbnail(stored_page):
+    import cv2
+    import numpy as np
+
+    paper_id, question_id = stored_page
+    response = client.get(f"/questions/{question_id}/image?w=200&fmt=webp", follow_redirects=False)
+    assert response.status_code == 307
+    location = response.headers["location"]
+    assert location.startswith(f"/images/questions/{question_id}/")
+    assert "bbox=100%2C200%2C400%2C300" in location
+
+    image = client.get(location)
+    assert image.status_code == 200
+    assert image.headers["content-type"] == "image/webp"
+    assert "immutable" in image.headers["cache-control"]
+    decoded = cv2.imdecode(np.frombuffer(image.content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    # 400x300 crop resized down to the 320 width bucket
+    assert decoded.shape[:2] == (240, 320)
+
+    # Revalidation is answered without rendering
+    etag = image.headers["etag"]
+    assert client.get(location, headers={"If-None-Match": etag}).status_code == 304
+
+def test_paper_image_negotiates_format_and_rejects_stale_keys(stored_page):
+    paper_id, _ = stored_page
+    response = client.get(f"/papers/{paper_id}/image", headers={"Accept": "image/jpeg"}, follow_redirects=False)
+    location = response.headers["location"]
+    assert location.endswith(".jpeg")
+    assert client.get(location).headers["content-type"] == "image/jpeg"
+
+    assert client.get(f"/images/papers/{paper_id}/0000000000000000deadbeef.jpeg").status_code == 404
+    assert client.get("/papers/9999/image").status_code == 404
+
+    # A matching If-None-Match doesn't turn an invalid key or source into a 304
+    stale = "0000000000000000deadbeef"
+    assert client.get(f"/images/papers/{paper_id}/{stale}.jpeg",
+                      headers={"If-None-Match": f'"{stale}"'}).status_code == 404
+    key = location.split("/")[-1].split(".")[0]
+    assert client.get(f"/images/papers/9999/{key}.jpeg", headers={"If-None-Match": f'"{key}"'}).status_code == 404
+
+def test_search_ranks_pages_and_tracks_updates_and_deletes():
+    from app import models
+    db = TestingSessionLocal()
+    paper = models.Paper(filename="s.jpg", file_path="s.jpg")
+    other = models.Paper(filename="t.jpg", file_path="t.jpg")
+    db.add_all([paper, other])
+    db.flush()
+    q1 = models.Question(paper_id=paper.id, ocr_text="求二次函数 y=x^2 的顶点坐标", order_index=0)
+    q2 = models.Question(paper_id=paper.id, ocr_text="计算三角形面积", analysis="用到二次函数的性质", order_index=1)
+    q3 = models.Question(paper_id=other.id, ocr_text="一次函数的图像", order_index=0)
+    db.add_all([q1, q2, q3])
+    db.commit()
+    ids = (q1.id, q2.id, q3.id, paper.id)
+    db.close()
+
+    data = client.get("/search", params={"q": "二次函数"}).json()
+    assert data["total"] == 2
+    # A hit in the question text outranks one in the analysis
+    assert [r["question_id"] for r in data["results"]] == [ids[0], ids[1]]
+    assert "<mark>二次函数</mark>" in data["results"][0]["snippet"]
+
+    page2 = client.get("/search", params={"q": "函数", "page": 2, "page_size": 2}).json()
+    assert page2["total"] == 3 and len(page2["results"]) == 1
+    assert client.get("/search", params={"q": "函数", "paper_id": ids[3]}).json()["total"] == 2
+
+    # Edits are indexed in the same transaction
+    db = TestingSessionLocal()
+    db.get(models.Question, ids[2]).ocr_text = "抛物线的焦点"
+    db.commit()
+    db.close()
+    assert client.get("/search", params={"q": "抛物线"}).json()["results"][0]["question_id"] == ids[2]
+
+    # Cascade delete (done by SQLite, not the ORM) removes entries too
+    client.delete(f"/papers/{ids[3]}")
+    assert client.get("/search", params={"q": "函数"}).json()["total"] == 0
+
+def test_batches_validate_kind_and_format_needs_ids():
+    assert client.post("/batches", params={"kind": "translate"}).status_code == 400
+    assert client.post("/batches", params={"kind": "format"}).status_code == 400
+    assert client.post("/batches", params={"kind": "solve"}).json() == {"status": "nothing_to_submit"}
+    assert client.get("/batches/999").status_code == 404
+
+def test_interactive_solve_and_background_solve_of_same_text_share_one_worker(tmp_path):
+    import threading
+    from unittest.mock import patch
+    from app import models
+    from app.services import pipeline
+    from app.services.scheduler import PriorityScheduler
+
+    file_engine = create_engine(f"sqlite:///{tmp_path / 'solve.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=file_engine)
+    FileSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=file_engine)
+
+    db = FileSessionLocal()
+    paper = models.Paper(filename="dup.jpg", file_path="dup.jpg")
+    paper.questions = [models.Question(ocr_text="1+1=?"), models.Question(ocr_text="1+1=?")]
+    db.add(paper)
+    db.commit()
+    background_id, interactive_id = (q.id for q in paper.questions)
+    db.close()
+
+    lane = PriorityScheduler("llm", workers=1)
+    formatting, release = threading.Event(), threading.Event()
+
+    def slow_format(text):
+        formatting.set()
+        release.wait(5)
+        return {"formatted_text": text, "is_complete": True}
+
+    def file_db():
+        session = FileSessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app.dependency_overrides[get_db] = file_db
+    responses = []
+    try:
+        with patch("app.services.pipeline.SessionLocal", FileSessionLocal), \
+             patch("app.services.scheduler.llm", lane), \
+             patch("app.services.pipeline.llm.format_and_check_question", side_effect=slow_format), \
+             patch("app.services.pipeline.routing.solve_question", return_value={"answer": "2", "analysis": "1+1=2"}):
+            # The only worker is busy formatting a duplicate when the interactive solve arrives
+            background = lane.submit(pipeline.solve_question_in_background, background_id)
+            assert formatting.wait(5)
+            interactive = threading.Thread(
+                target=lambda: responses.append(client.post(f"/solve/{interactive_id}")), daemon=True
+            )
+            interactive.start()
+            while lane.pending() < 2:
+                pass
+            release.set()
+
+            background.result(5)
+            interactive.join(5)
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+
+    assert not interactive.is_alive()
+    assert responses[0].json() == {"solution": "1+1=2", "answer": "2"}
+    db = FileSessionLocal()
+    assert db.get(models.Question, background_id).answer == "2"
+    db.close()
+
+def test_reprocess_supersedes_in_flight_run_and_releases_its_token(tmp_path):
+    import threading
+    import time
+    from concurrent.futures import CancelledError
+    from unittest.mock import patch
+    from app import models
+    from app.services import cancellation, pipeline
+
+    file_engine = create_engine(f"sqlite:///{tmp_path / 'reprocess.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=file_engine)
+    FileSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=file_engine)
+
+    db = FileSessionLocal()
+    paper = models.Paper(filename="r.jpg", file_path="static/uploads/r.jpg")
+    db.add(paper)
+    db.commit()
+    paper_id = paper.id
+    scope = cancellation.paper_scope(paper_id)
+
+    first_ocr, release_first = threading.Event(), threading.Event()
+    ocr_calls = []
+    def fake_ocr(path):
+        ocr_calls.append(path)
+        if len(ocr_calls) == 1:
+            first_ocr.set()
+            release_first.wait(5)
+            return "old text"
+        return "new text"
+
+    def fake_split(full_text):
+        yield f"Q1 {full_text}"
+        yield f"Q2 {full_text}"
+
+    results = {}
+    def call(name, **kwargs):
+        try:
+            results[name] = pipeline.process_paper(paper_id, "teacher", **kwargs)
+        except CancelledError:
+            results[name] = "cancelled"
+
+    with patch("app.services.pipeline.SessionLocal", FileSessionLocal), \
+         patch("app.services.pipeline.vision.read_full_page", side_effect=lambda path: _ocr_page(fake_ocr(path))), \
+         patch("app.services.pipeline.llm.stream_split_questions", side_effect=fake_split), \
+         patch("app.services.pipeline.llm.format_and_check_question",
+               side_effect=lambda text: {"formatted_text": text, "is_complete": True}), \
+         patch("app.services.pipeline.routing.solve_question", return_value={"answer": "A", "analysis": "..."}):
+        first = threading.Thread(target=call, args=("first",))
+        first.start()
+        assert first_ocr.wait(5)
+        first_token = cancellation._tokens[scope]
+        second = threading.Thread(target=call, args=("reprocess",), kwargs={"reprocess": True})
+        second.start()
+        for _ in range(500):
+            if first_token.cancelled:
+                break
+            time.sleep(0.01)
+        release_first.set()
+        first.join(5)
+        second.join(5)
+
+        # The queued solves hold the token; it's dropped once they are done
+        for _ in range(500):
+            if scope not in cancellation._tokens:
+                break
+            time.sleep(0.01)
+
+    assert results == {"first": "cancelled", "reprocess": {"status": "processing_started", "questions_found": 2}}
+    assert len(ocr_calls) == 2
+    questions = db.query(models.Question).order_by(models.Question.order_index).all()
+    assert [q.ocr_text for q in questions] == ["Q1 new text", "Q2 new text"]
+    assert all(q.answer == "A" for q in questions)
+    assert scope not in cancellation._tokens
+    assert pipeline._generations == {}
+    db.close()
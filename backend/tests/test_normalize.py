@@ -0,0 +1,39 @@
+from app.services import normalize
+
+def _box(text, left, top, right, bottom, confidence=0.9):
+    return ([[left, top], [right, top], [right, bottom], [left, bottom]], text, confidence)
+
+def _page(header="某某中学期中考试 数学", footer="第1页 共4页"):
+    return [
+        _box(header, 100, 10, 700, 40),
+        _box("题号 一 二 三 总分", 100, 60, 700, 90),
+        _box("1. 已知函数 f(x)=x^2+1, 求f(x)在", 50, 120, 700, 150),
+        _box("区间[0,2]上的最大值。", 50, 155, 400, 185),
+        _box("~", 710, 130, 720, 140, confidence=0.1),
+        _box("l", 300, 300, 310, 320, confidence=0.2),
+        _box("A. 5", 50, 200, 150, 230),
+        _box("B. 3", 300, 202, 400, 232),
+        _box(footer, 300, 960, 500, 990),
+    ]
+
+def test_normalize_drops_noise_and_merges_lines_by_geometry():
+    page = normalize.normalize_page(_page(), page_height=1000)
+
+    assert page.text.split("\n") == [
+        "某某中学期中考试 数学",
+        "1. 已知函数 f(x)=x^2+1, 求f(x)在区间[0,2]上的最大值。",
+        "A. 5 B. 3",
+    ]
+    assert page.dropped == {"noise": 2, "page_number": 1, "score_box": 1}
+    assert page.tokens_after < page.tokens_before
+
+def test_item_starts_are_never_glued_to_previous_line():
+    lines = normalize.to_lines([
+        _box("2. 计算下列各式", 50, 100, 400, 130),
+        _box("(1) 3+4", 50, 135, 200, 165),
+    ])
+    assert normalize.merge_lines(lines) == ["2. 计算下列各式", "(1) 3+4"]
+
+def test_score_box_detection_keeps_questions_mentioning_scores():
+    assert normalize.is_score_box(normalize.OCRLine("得分 评卷人", 0.9, 0, 0, 1, 1))
+    assert not normalize.is_score_box(normalize.OCRLine("本题满分10分，求总分", 0.9, 0, 0, 1, 1))
@@ -0,0 +1,124 @@
+import os
+import numpy as np
+import pytest
+from unittest.mock import patch, MagicMock
+import app.services.ocr as ocr_module
+
+@patch("app.services.ocr.easyocr.Reader")
+def test_create_engine_default(mock_reader_cls):
+    with patch.dict(os.environ, {}, clear=False):
+        os.environ.pop("OCR_ENGINE", None)
+        engine = ocr_module.create_engine()
+    assert engine.name == "easyocr"
+    mock_reader_cls.assert_called_once_with(['ch_sim', 'en'], gpu=False)
+
+@patch("app.services.ocr.quantize_recognizer")
+@patch("app.services.ocr.easyocr.Reader")
+def test_quantized_engine_passes_cpu_defaults(mock_reader_cls, mock_quantize):
+    with patch.dict(os.environ, {"OCR_ENGINE": "quantized", "OCR_CANVAS_SIZE": "1024", "OCR_BATCH_SIZE": "4"}):
+        engine = ocr_module.create_engine()
+    assert engine.name == "quantized"
+    mock_quantize.assert_called_once()
+
+    engine.readtext("img", detail=0)
+    mock_reader_cls.return_value.readtext.assert_called_with("img", detail=0, canvas_size=1024, batch_size=4)
+
+@patch("app.services.ocr.quantize_recognizer")
+@patch("app.services.ocr.easyocr.Reader")
+def test_onnx_engine_falls_back_without_weights(mock_reader_cls, mock_quantize):
+    with patch.dict(os.environ, {"OCR_ENGINE": "onnx", "OCR_ONNX_MODEL": "does/not/exist.onnx"}):
+        engine = ocr_module.create_engine()
+    assert engine.name == "quantized"
+
+def test_character_error_rate():
+    assert ocr_module.character_error_rate("abc", "abc") == 0.0
+    assert ocr_module.character_error_rate("a b c", "abc") == 0.0
+    assert ocr_module.character_error_rate("abcd", "abed") == pytest.approx(0.25)
+    assert ocr_module.character_error_rate("", "") == 0.0
+
+@patch("app.services.ocr.create_engine")
+def test_compare_engines_uses_ground_truth(mock_create_engine, tmp_path):
+    import cv2
+    import numpy as np
+
+    page = tmp_path / "page.png"
+    cv2.imwrite(str(page), np.zeros((10, 10, 3), dtype=np.uint8))
+    (tmp_path / "page.txt").write_text("1+1=2", encoding="utf-8")
+
+    def make_engine(name):
+        engine = MagicMock()
+        engine.name = name
+        engine.readtext.return_value = ["1+1=2"] if name == "easyocr" else ["1+1=3"]
+        return engine
+    mock_create_engine.side_effect = make_engine
+
+    report = ocr_module.compare_engines([str(page)], ["quantized"])
+
+    assert set(report) == {"easyocr", "quantized"}
+    assert report["easyocr"]["cer"] == 0.0
+    assert report["quantized"]["cer"] == pytest.approx(0.2)
+    assert report["quantized"]["ms_per_page"] >= 0
+
+def test_engine_missing_a_method_fails_on_construction():
+    class ReadOnlyEngine(ocr_module.OCREngine):
+        def readtext(self, image, detail=1, **kwargs):
+            return []
+
+    with pytest.raises(TypeError):
+        ReadOnlyEngine()
+
+class _FakeEngine(ocr_module.OCREngine):
+    """
+    Fast pass returns two lines, one of them unreadable; recognition gives better readings.
+    """
+    def __init__(self, recognized):
+        self.recognized = recognized
+        self.readtext_shapes = []
+        self.recognize_calls = []
+
+    def readtext(self, image, detail=1, **kwargs):
+        self.readtext_shapes.append(image.shape)
+        return [
+            ([[10, 10], [200, 10], [200, 30], [10, 30]], "1. 已知函数", 0.95),
+            ([[10, 50], [300, 50], [300, 70], [10, 70]], "f(x)=x^Z", 0.2),
+        ]
+
+    def recognize(self, grey, boxes, **kwargs):
+        self.recognize_calls.append((grey.copy(), boxes))
+        x_min, x_max, y_min, y_max = boxes[0]
+        corners = [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+        text, confidence = self.recognized[len(self.recognize_calls) - 1]
+        return [(corners, text, confidence)]
+
+def test_adaptive_read_page_rechecks_only_low_confidence_lines():
+    page = np.full((2560, 1000, 3), 255, dtype=np.uint8)
+    engine = _FakeEngine([("f(x)=x^2", 0.9)])
+    with patch.dict(os.environ, {"OCR_FAST_MAX_SIDE": "1280", "OCR_RECHECK_CONFIDENCE": "0.5"}):
+        results = ocr_module.read_page(engine, page, mode="adaptive")
+
+    # Fast pass on a half-size copy, boxes mapped back to native coordinates
+    assert engine.readtext_shapes == [(1280, 500, 3)]
+    assert results[0][0][2] == [400, 60]
+    assert [(text, conf) for _, text, conf in results] == [("1. 已知函数", 0.95), ("f(x)=x^2", 0.9)]
+
+    # Only the low-confidence line was re-read, on the native-resolution grey page
+    assert len(engine.recognize_calls) == 1
+    grey, boxes = engine.recognize_calls[0]
+    assert grey.shape == (2560, 1000)
+    assert len(boxes) == 1 and boxes[0][2] < 100 < boxes[0][3]
+
+def test_adaptive_read_page_tries_contrast_enhancement_and_keeps_best_reading():
+    page = np.full((800, 600, 3), 255, dtype=np.uint8)
+    # Native re-read is no better, the CLAHE pass is; a worse reading never replaces a better one
+    engine = _FakeEngine([("f(x)=x^Z", 0.1), ("f(x)=x^2", 0.7)])
+    results = ocr_module.read_page(engine, page, mode="adaptive")
+
+    assert len(engine.recognize_calls) == 2
+    assert results[1][1:] == ("f(x)=x^2", 0.7)
+
+def test_read_page_full_mode_is_a_single_readtext():
+    engine = MagicMock()
+    page = np.zeros((10, 10, 3), dtype=np.uint8)
+    assert ocr_module.read_page(engine, page, mode="full") is engine.readtext.return_value
+    engine.readtext.assert_called_once_with(page, detail=1)
+    engine.recognize.assert_not_called()
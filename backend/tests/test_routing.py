@@ -0,0 +1,58 @@
+import os
+from unittest.mock import patch
+from app.services import routing
+
+CHOICE_QUESTION = "1. 下列哪个数是质数？\nA. 4\nB. 6\nC. 7\nD. 9"
+PROOF_QUESTION = "已知 $a>0, b>0$，求证：$a^2+b^2 \\ge 2ab$。"
+MULTI_PART_QUESTION = "已知函数 f(x)=x^2-2x。(1) 求 f(x) 的最小值；(2) 解不等式 f(x)>3。"
+
+def test_classify_choice_question_is_easy():
+    profile = routing.classify_question(CHOICE_QUESTION)
+    assert profile.kind == "choice"
+    assert profile.has_options
+    assert profile.difficulty == "easy"
+
+def test_classify_proof_and_multi_part_are_hard():
+    assert routing.classify_question(PROOF_QUESTION).kind == "proof"
+    assert routing.classify_question(PROOF_QUESTION).difficulty == "hard"
+    profile = routing.classify_question(MULTI_PART_QUESTION)
+    assert profile.parts == 2
+    assert profile.has_math
+    assert profile.difficulty == "hard"
+
+def test_validate_choice_answer_must_be_an_option():
+    profile = routing.classify_question(CHOICE_QUESTION)
+    assert routing.validate_solution({"answer": "C", "analysis": "..."}, profile)
+    assert not routing.validate_solution({"answer": "7", "analysis": "..."}, profile)
+    assert not routing.validate_solution({"answer": "", "analysis": "..."}, profile)
+
+@patch("app.services.routing.llm.solve_question")
+def test_easy_question_stays_on_fast_model(mock_solve):
+    mock_solve.return_value = {"answer": "C", "analysis": "7 是质数"}
+    with patch.dict(os.environ, {"LLM_FAST_MODEL": "fast-model", "LLM_MODEL": "strong-model"}):
+        result = routing.solve_question(CHOICE_QUESTION)
+
+    assert result["model"] == "fast-model"
+    assert result["answer"] == "C"
+    mock_solve.assert_called_once_with(CHOICE_QUESTION, model="fast-model")
+
+@patch("app.services.routing.llm.solve_question")
+def test_invalid_fast_answer_escalates(mock_solve):
+    mock_solve.side_effect = [{"answer": "seven", "analysis": "..."}, {"answer": "C", "analysis": "..."}]
+    with patch.dict(os.environ, {"LLM_FAST_MODEL": "fast-model", "LLM_MODEL": "strong-model"}):
+        result = routing.solve_question(CHOICE_QUESTION)
+
+    assert result["model"] == "strong-model"
+    assert result["escalated"]
+    assert mock_solve.call_count == 2
+
+@patch("app.services.routing.llm.solve_question")
+def test_hard_question_and_no_fast_tier_use_strong_model(mock_solve):
+    mock_solve.return_value = {"answer": "见解析", "analysis": "..."}
+    with patch.dict(os.environ, {"LLM_FAST_MODEL": "fast-model", "LLM_MODEL": "strong-model"}):
+        assert routing.solve_question(PROOF_QUESTION)["model"] == "strong-model"
+
+    with patch.dict(os.environ, {"LLM_MODEL": "strong-model"}):
+        os.environ.pop("LLM_FAST_MODEL", None)
+        assert routing.solve_question(CHOICE_QUESTION)["model"] == "strong-model"
+    assert mock_solve.call_count == 2
@@ -0,0 +1,115 @@
+import threading
+import pytest
+from app.services import scheduler
+from app.services.scheduler import PriorityScheduler
+
+def _blocked_scheduler(**kwargs):
+    """
+    Single-worker scheduler whose worker is parked on an event,
+    so everything submitted afterwards queues up until release() is called.
+    """
+    sched = PriorityScheduler("test", workers=1, **kwargs)
+    gate = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        gate.wait(5)
+
+    sched.submit(block, priority=scheduler.INTERACTIVE)
+    assert started.wait(5)
+    return sched, gate.set
+
+def test_run_returns_result_and_raises():
+    sched = PriorityScheduler("test", workers=2)
+    assert sched.run(lambda a, b: a + b, 1, b=2) == 3
+
+    def boom():
+        raise ValueError("bad")
+    with pytest.raises(ValueError):
+        sched.run(boom)
+
+def test_interactive_preempts_queued_background_work():
+    sched, release = _blocked_scheduler(aging_seconds=0)
+    order = []
+
+    futures = [
+        sched.submit(order.append, "backfill", priority=scheduler.BACKFILL),
+        sched.submit(order.append, "fresh", priority=scheduler.FRESH_UPLOAD),
+        sched.submit(order.append, "interactive", priority=scheduler.INTERACTIVE),
+    ]
+    assert sched.pending() == 4
+    release()
+    for f in futures:
+        f.result(5)
+
+    assert order == ["interactive", "fresh", "backfill"]
+
+def test_aging_promotes_long_waiting_tasks():
+    sched, release = _blocked_scheduler(aging_seconds=10)
+    order = []
+
+    old = sched.submit(order.append, "old-backfill", priority=scheduler.BACKFILL)
+    new = sched.submit(order.append, "new-fresh", priority=scheduler.FRESH_UPLOAD)
+    # Pretend the backfill task has been waiting for 25s: promoted two classes
+    with sched._cond:
+        sched._queue[0].enqueued_at -= 25
+    release()
+    old.result(5)
+    new.result(5)
+
+    assert order == ["old-backfill", "new-fresh"]
+
+def test_aged_background_work_never_overtakes_interactive():
+    sched, release = _blocked_scheduler(aging_seconds=60)
+    order = []
+
+    futures = []
+    for i in range(3):
+        futures.append(sched.submit(order.append, f"fresh{i}", priority=scheduler.FRESH_UPLOAD, user="10.0.0.1"))
+        futures.append(sched.submit(order.append, f"backfill{i}", priority=scheduler.BACKFILL, user="10.0.0.1"))
+    # Everything queued has waited 130s: backfill is promoted once, nothing reaches INTERACTIVE
+    with sched._cond:
+        for task in sched._queue:
+            task.enqueued_at -= 130
+    futures.append(sched.submit(order.append, "click", priority=scheduler.INTERACTIVE, user="10.0.0.1"))
+    release()
+    for f in futures:
+        f.result(5)
+
+    assert order[0] == "click"
+    assert order[1:] == ["fresh0", "backfill0", "fresh1", "backfill1", "fresh2", "backfill2"]
+
+def test_users_are_served_round_robin_within_a_class():
+    sched, release = _blocked_scheduler(aging_seconds=0)
+    order = []
+
+    futures = [sched.submit(order.append, f"a{i}", user="alice") for i in range(3)]
+    futures.append(sched.submit(order.append, "b0", user="bob"))
+    release()
+    for f in futures:
+        f.result(5)
+
+    assert order[:2] == ["a0", "b0"]
+
+def test_cancelled_future_is_skipped():
+    sched, release = _blocked_scheduler()
+    calls = []
+
+    future = sched.submit(calls.append, "x")
+    assert future.cancel()
+    release()
+    sched.run(calls.append, "y")
+
+    assert calls == ["y"]
+
+def test_pending_filters_queued_and_running_by_priority():
+    sched, release = _blocked_scheduler(aging_seconds=0)
+    backfill = sched.submit(lambda: None, priority=scheduler.BACKFILL)
+
+    # The parked INTERACTIVE task is running and counts as live traffic
+    assert sched.pending(max_priority=scheduler.FRESH_UPLOAD) == 1
+    assert sched.pending() == 2
+    release()
+    backfill.result(5)
+    assert sched.pending(max_priority=scheduler.FRESH_UPLOAD) == 0
@@ -0,0 +1,18 @@
+from app.services import search
+
+def test_segment_uses_cjk_bigrams_and_lowercase_words():
+    assert search.segment("解方程 Find X2") == ["解方", "方程", "程", "find", "x2"]
+    assert search.segment("解方程", query=True) == ["解方", "方程"]
+    assert search.segment("圆", query=True) == ["圆"]
+
+def test_match_expression_quotes_terms_and_prefixes_single_characters():
+    assert search.match_expression('函数 "OR" x') == '"函数" "or" "x"'
+    assert search.match_expression("圆") == '"圆"*'
+    assert search.match_expression("  ,. ") == ""
+
+def test_snippet_marks_hits_and_escapes_html():
+    text = "前言" * 30 + "已知 <b> 二次函数 y=x^2，求顶点"
+    result = search.snippet(text, "二次函数", width=30)
+    assert result.startswith("…")
+    assert "<mark>二次函数</mark>" in result
+    assert "&lt;b&gt;" in result
@@ -0,0 +1,52 @@
+import threading
+import time
+import pytest
+from app.services.singleflight import SingleFlight, content_key
+
+def _start_leader(group, key, fn):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(group.do(key, fn)))
+    thread.start()
+    return thread, results
+
+def test_concurrent_callers_share_one_execution():
+    group = SingleFlight()
+    gate = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        gate.wait(5)
+        return {"answer": "C"}
+
+    leader, leader_results = _start_leader(group, ("solve", 1), work)
+    while not group.in_flight(("solve", 1)):
+        time.sleep(0.001)
+
+    followers = [_start_leader(group, ("solve", 1), work) for _ in range(3)]
+    # Give the followers time to join the in-flight call before the leader finishes
+    time.sleep(0.2)
+    gate.set()
+    leader.join(5)
+    for thread, _ in followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert leader_results == [{"answer": "C"}]
+    assert all(results == [{"answer": "C"}] for _, results in followers)
+    assert not group.in_flight(("solve", 1))
+
+def test_errors_propagate_and_key_is_released():
+    group = SingleFlight()
+
+    def boom():
+        raise RuntimeError("llm down")
+
+    with pytest.raises(RuntimeError):
+        group.do("k", boom)
+    # Nothing is cached, the next call runs again
+    assert group.do("k", lambda: 42) == 42
+
+def test_content_key_is_stable_and_separates_parts():
+    assert content_key("abc") == content_key("abc")
+    assert content_key("ab", "c") != content_key("a", "bc")
@@ -0,0 +1,50 @@
+import pytest
+from app.services import structured
+from app.services.structured import SolutionOutput, SplitOutput, FormatOutput, StructuredOutputError
+
+def test_parse_handles_fences_prose_and_trailing_text():
+    raw = '当然，解答如下：\n```json\n{"answer": "C", "analysis": "7 是质数"}\n```\n以上。'
+    assert structured.parse(raw, SolutionOutput).model_dump() == {"answer": "C", "analysis": "7 是质数"}
+    assert structured.parse('{"answer": 42} and more {"x": 1}', SolutionOutput).answer == "42"
+
+def test_unescaped_latex_is_kept_intact():
+    # \frac, \times, \neq and \theta are valid JSON escapes (\f \t \n); \sqrt and \alpha are not
+    raw = r'{"answer": "$\frac{1}{2}$", "analysis": "$a \times b \neq \sqrt{2}\alpha$, \theta\nnext line"}'
+    solution = structured.parse(raw, SolutionOutput)
+    assert solution.answer == r"$\frac{1}{2}$"
+    assert solution.analysis == "$a \\times b \\neq \\sqrt{2}\\alpha$, \\theta\nnext line"
+
+def test_well_formed_json_keeps_its_newlines_and_tabs():
+    raw = '{"answer": "3", "analysis": "因此\\nu = 3，\\ne^x 单调\\n\\tan apple, $\\\\frac{1}{2}$"}'
+    solution = structured.parse(raw, SolutionOutput)
+    assert solution.analysis == "因此\nu = 3，\ne^x 单调\n\tan apple, $\\frac{1}{2}$"
+    # \f and \b are never meant as control characters, so a known command after them is LaTeX
+    assert structured.loads(r'{"analysis": "$\frac{1}{2}$, $\beta$, \\frac"}') == {"analysis": r"$\frac{1}{2}$, $\beta$, \frac"}
+
+def test_repair_closes_truncated_output_and_drops_trailing_commas():
+    assert structured.loads('{"questions": ["Q1", "Q2",]}') == {"questions": ["Q1", "Q2"]}
+    assert structured.loads('{"questions": ["Q1", "Q2 is cut') == {"questions": ["Q1", "Q2 is cut"]}
+    assert structured.loads('{"formatted_text": "x", "is_complete":') == {"formatted_text": "x", "is_complete": None}
+
+def test_split_schema_accepts_bare_lists_and_wrapped_items():
+    assert structured.parse('[{"question": "Q1"}, " Q2 ", ""]', SplitOutput).questions == ["Q1", "Q2"]
+    with pytest.raises(StructuredOutputError):
+        structured.parse('{"questions": []}', SplitOutput)
+
+def test_schema_and_syntax_failures_raise_with_raw_text():
+    with pytest.raises(StructuredOutputError) as e:
+        structured.parse("答案是 C", SolutionOutput)
+    assert e.value.raw == "答案是 C"
+    with pytest.raises(StructuredOutputError, match="formatted_text"):
+        structured.parse('{"is_complete": true}', FormatOutput)
+
+def test_generate_retries_once_with_feedback():
+    calls = []
+
+    def run(feedback):
+        calls.append(feedback)
+        return '{"formatted_text": "1+1=?", "is_complete": "false"}' if feedback else "not json"
+
+    result = structured.generate(run, FormatOutput)
+    assert result.model_dump() == {"formatted_text": "1+1=?", "is_complete": False}
+    assert calls[0] is None and calls[1][0] == "not json"
@@ -10,7 +10,7 @@ def reset_reader():
     yield
     vision_module._reader = None
 
-@patch("app.services.vision.easyocr.Reader")
+@patch("app.services.ocr.easyocr.Reader")
 def test_get_reader(mock_reader_cls):
     # Test singleton behavior
     r1 = vision_module.get_reader()
@@ -24,8 +24,6 @@ def test_get_reader(mock_reader_cls):
 @patch("app.services.vision.get_reader") # Mock get_reader to return our mock reader
 def test_process_image_success(mock_get_reader, mock_os, mock_np, mock_cv2):
     # Setup basic mocks
-    output_dir = "test_output"
-    
     # 1. Image loading
     # Mock fromfile and imdecode
     mock_cv2.imdecode.return_value = MagicMock(name='image')
@@ -55,17 +53,17 @@ def test_process_image_success(mock_get_reader, mock_os, mock_np, mock_cv2):
     mock_reader_instance.readtext.return_value = ["Question 1"]
         
     # Run
-    results = vision_module.process_image("dummy_path.jpg", output_dir)
+    results = vision_module.process_image("dummy_path.jpg")
     
     # Assertions
     assert len(results) == 2
     assert results[0]['ocr_text'] == "Question 1"
     
-    # Check if imwrite was called 2 times (once per crop)
-    assert mock_cv2.imwrite.call_count == 2
+    assert results[1]['bbox'] == [0, 200, 200, 100]
     
-    # Check if directory was made
-    mock_os.makedirs.assert_called_with(output_dir, exist_ok=True)
+    # Crops are rendered on demand from the bbox, nothing is written at processing time
+    mock_cv2.imwrite.assert_not_called()
+    mock_os.makedirs.assert_not_called()
 
 @patch("app.services.vision.cv2")
 @patch("app.services.vision.np")
@@ -75,5 +73,5 @@ def test_process_image_read_fail(mock_np, mock_cv2):
     mock_cv2.imread.return_value = None
     
     with pytest.raises(ValueError):
-        vision_module.process_image("baduserpath.jpg", "out")
+        vision_module.process_image("baduserpath.jpg")
 
@@ -127,7 +127,7 @@ export default function Workspace({ data, onBack }: { data: PaperData; onBack: (
              {/* Actual implementation of bbox overlay is complex without exact scaling factors.
                  We will just show the full image here.*/}
              <img 
-                src={`${API_URL}/static/${data.paper.file_path.split('static/')[1]}`} 
+                src={`${API_URL}/papers/${data.paper.id}/image?w=1280`} 
                 alt="Original" 
                 className="w-full shadow-lg rounded-lg"
              />
@@ -160,7 +160,7 @@ export default function Workspace({ data, onBack }: { data: PaperData; onBack: (
 
                     {/* Crop Image */}
                     <div className="border rounded bg-gray-50 p-2 flex justify-center">
-                        <img src={`${API_URL}/${q.image_path}`} alt={`Q${idx+1}`} className="max-h-40 object-contain" />
+                        <img src={`${API_URL}/questions/${q.id}/image?w=640`} alt={`Q${idx+1}`} loading="lazy" className="max-h-40 object-contain" />
                     </div>
 
                     {/* OCR Text */}